@@ -1,29 +1,141 @@
 import os
-from flask import Flask, request, abort, jsonify
+import base64
+import time
+from flask import (Flask, Response, request, abort, jsonify,
+                   stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
-from models import setup_db, Artist, Client, Appointment
-from auth.auth import requires_auth, AuthError
+from sqlalchemy.exc import IntegrityError
+from bisect import bisect_left, insort
+from models import (setup_db, db, bulk_insert, is_booking_conflict, search,
+                    has_style, formatted_rows, iter_formatted, pool_stats, ping_database,
+                    Artist, Client, Appointment,
+                    APPOINTMENT_MINUTES, MAX_APPOINTMENT_MINUTES)
+from counters import counter_cache
+from versions import table_versions
+from response_cache import response_cache, cached, PUBLIC_SCOPE
+from serialization import json_response, ndjson_chunks, csv_chunks
+from metrics import setup_metrics, render_metrics
+from health import HealthChecks
+from auth.auth import requires_auth, AuthError, jwks_cache, token_cache
 
 
 '''
 Common functions used in the app
 '''
 CLIENTS_PER_PAGE = 10
+APPOINTMENTS_PER_PAGE = 10
+MAX_PER_PAGE = 100
+BULK_MAX_BATCH_SIZE = int(os.environ.get('BULK_MAX_BATCH_SIZE', 1000))
+MAX_AVAILABILITY_DAYS = 31
+AVAILABLE_ARTISTS_PER_PAGE = 10
+SEARCH_PER_PAGE = 10
+MAX_SEARCH_LENGTH = 100
+# Seconds shared caches such as a CDN may serve the public artist
+# endpoints without revalidating. Browsers revalidate on every use
+ARTISTS_CDN_MAX_AGE = int(os.environ.get('ARTISTS_CDN_MAX_AGE', 60))
+# Seconds a host may answer 304 after a write made on another host when
+# table versions are kept on each host, see versions. 0 trusts them
+LOCAL_ETAG_WINDOW = int(os.environ.get('LOCAL_ETAG_WINDOW', 60))
+# Tables read by the cached GET endpoints
+ARTISTS = Artist.__table__.name
+CLIENTS = Client.__table__.name
+APPOINTMENTS = Appointment.__table__.name
+# Tables which can be exported, by the name used in the export URL
+EXPORT_MODELS = {'artists': Artist, 'clients': Client, 'appointments': Appointment}
+# Rows read from the database and sent per chunk of an export
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
 # Paginate Clients
 
 
-def paginate_clients(request, clients):
+# Pages are selected in the database with LIMIT/OFFSET, or by seeking
+# past the last client id when a cursor is given. Returns the formatted
+# clients and the cursor for the next page
+def paginate_clients(request):
+    per_page = get_per_page(request, CLIENTS_PER_PAGE)
+    cursor = request.args.get('cursor', None)
+    query = Client.query.order_by(Client.id)
+
+    if cursor is not None:
+        last_id, = decode_cursor(cursor, 1)
+        if not isinstance(last_id, int):
+            abort(422)
+        query = query.filter(Client.id > last_id)
+    else:
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            abort(404)
+        query = query.offset((page - 1)*per_page)
+
+    clients = formatted_rows(query.limit(per_page + 1), Client)
+
+    next_cursor = None
+    if len(clients) > per_page:
+        clients = clients[:per_page]
+        next_cursor = encode_cursor([clients[-1]['id']])
+
+    return clients, next_cursor
+
+
+# Get a search parameter, or None when it is not given. Blank and overly
+# long values return 422
+def get_search_arg(request, name):
+    value = request.args.get(name, None)
+    if value is None:
+        return None
+
+    value = value.strip()
+    if not value or len(value) > MAX_SEARCH_LENGTH:
+        abort(422)
+
+    return value
+
+
+# Page through search results of model in the order the query ranks
+# them. Returns the formatted rows and the number of the next page, or
+# None on the last page
+def paginate_search(request, query, model):
+    per_page = get_per_page(request, SEARCH_PER_PAGE)
     page = request.args.get('page', 1, type=int)
-    start = (page - 1)*CLIENTS_PER_PAGE
-    end = start + CLIENTS_PER_PAGE
+    if page < 1:
+        abort(404)
+
+    rows = formatted_rows(query.offset((page - 1)*per_page).limit(per_page + 1),
+                          model)
+    next_page = page + 1 if len(rows) > per_page else None
+
+    return rows[:per_page], next_page
+
+
+# Get the requested page size, capped at MAX_PER_PAGE
+def get_per_page(request, default):
+    per_page = request.args.get('per_page', default, type=int)
+    if per_page < 1:
+        abort(422)
+
+    return min(per_page, MAX_PER_PAGE)
 
-    format_clients = [client.format() for client in clients]
-    current_clients = format_clients[start:end]
 
-    return current_clients
+# Encode the sort key of the last row on a page as an opaque cursor
+def encode_cursor(values):
+    data = json.dumps(values).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+# Decode a cursor created by encode_cursor holding length values
+# or return 422
+def decode_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        values = None
+
+    if not isinstance(values, list) or len(values) != length:
+        abort(422)
+
+    return values
 
 
 # Format date string and check if correct datetime format
@@ -36,6 +148,90 @@ def format_datetime(date_time):
         abort(422)
 
 
+# Get a required date query parameter or return 422
+def get_date_arg(request, name):
+    date_time = format_datetime(request.args.get(name, None))
+    if date_time is None:
+        abort(422)
+
+    return date_time
+
+
+# Get the requested slot length in minutes as a timedelta
+def get_duration(request):
+    duration = request.args.get('duration', APPOINTMENT_MINUTES, type=int)
+    if duration < 1:
+        abort(422)
+
+    return timedelta(minutes=duration)
+
+
+# ETag of the responses built from a table and whether it is weak. It
+# changes with every write to the table. Versions kept on each host miss
+# the writes of other hosts, so their ETag also changes every
+# LOCAL_ETAG_WINDOW seconds and is weak
+def table_etag(table):
+    etag = '{}-{}'.format(table, table_versions.get(table))
+    if table_versions.shared or not LOCAL_ETAG_WINDOW:
+        return etag, False
+
+    return '{}-{}'.format(etag, int(time.time() // LOCAL_ETAG_WINDOW)), True
+
+
+# Answer 304 when the request already holds the ETag of table, without
+# calling build. Otherwise build the response, or take it from the
+# response cache. Both are sent with the ETag and the Cache-Control of
+# the public artist endpoints
+def conditional_response(table, build):
+    etag, weak = table_etag(table)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = response_cache.respond(PUBLIC_SCOPE, (table,), build)
+
+    response.set_etag(etag, weak)
+    response.cache_control.public = True
+    response.cache_control.max_age = 0
+    response.cache_control.s_maxage = ARTISTS_CDN_MAX_AGE
+    return response
+
+
+# Check an appointment length in minutes given in a request body
+def valid_duration(duration):
+    return (isinstance(duration, int) and not isinstance(duration, bool)
+            and 0 < duration <= MAX_APPOINTMENT_MINUTES)
+
+
+# Respond 409 with the appointment of artist which overlaps [start, end).
+# Called after the exclusion constraint rejected a booking
+def booking_conflict(artist, start, end, exclude_id=None):
+    conflict = Appointment.find_conflict(artist, start, end, exclude_id)
+    return jsonify({
+                    'success': False,
+                    'error': 409,
+                    'message': 'Appointment overlaps an existing booking',
+                    'conflicting_appointment_id': conflict.id if conflict else None
+                    }), 409
+
+
+# Sweep the booked intervals, sorted by start, and return the gaps
+# between start and end which are at least duration long
+def free_intervals(busy, start, end, duration):
+    free = []
+    cursor = start
+    for busy_start, busy_end in busy:
+        if busy_start - cursor >= duration:
+            free.append((cursor, busy_start))
+        cursor = max(cursor, busy_end)
+        if cursor >= end:
+            break
+
+    if end - cursor >= duration:
+        free.append((cursor, end))
+
+    return free
+
+
 # Check database for artist
 def check_for_artist(artist):
     if artist is None:
@@ -57,32 +253,236 @@ def check_for_client(client):
         abort(404)
 
 
-# Check database for appointment
-def check_for_appointment(appt):
-    if appt is None:
-        return
+# Load a row by primary key, once per request, or return 404.
+# Handlers reuse the returned instance instead of loading it again
+def get_or_404(model, id, query=None):
+    if query is None:
+        query = model.query
 
-    check_appt = Appointment.query.get(appt)
-    if check_appt is None:
+    instance = query.get(id)
+    if instance is None:
         abort(404)
 
+    return instance
 
-# Format an artist
-def format_artist(artist_id):
-    artist = Artist.query.get(artist_id)
-    return artist.format()
 
+# Get the relationships to embed from the expand query parameter
+# e.g. ?expand=artist,client
+def get_expand(request):
+    expand = request.args.get('expand', '')
+    names = [name.strip() for name in expand.split(',') if name.strip()]
 
-# Format a client
-def format_client(client_id):
-    client = Client.query.get(client_id)
-    return client.format()
+    for name in names:
+        if name not in Appointment.expandable:
+            abort(422)
 
+    return tuple(dict.fromkeys(names))
+
+
+# Read the rows of a bulk request, sent either as a JSON array or as
+# newline delimited JSON (Content-Type: application/x-ndjson)
+def get_bulk_rows(request):
+    if request.mimetype == 'application/x-ndjson':
+        rows = []
+        for line in request.stream:
+            if not line.strip():
+                continue
+            if len(rows) == BULK_MAX_BATCH_SIZE:
+                abort(413)
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                abort(400)
+    else:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            abort(400)
+
+    if len(rows) == 0:
+        abort(422)
+    if len(rows) > BULK_MAX_BATCH_SIZE:
+        abort(413)
+
+    return rows
+
+
+# Check the text fields of a row against the model columns.
+# Returns the values to insert and a list of errors
+def validate_text_fields(model, row, fields, required=()):
+    if not isinstance(row, dict):
+        return None, ['row must be a JSON object']
+
+    values = {}
+    errors = []
+    for field in fields:
+        value = row.get(field, None if field in required else '')
+        if value is None and field in required:
+            errors.append(f'{field} is required')
+            continue
+        if value is not None and not isinstance(value, str):
+            errors.append(f'{field} must be a string')
+            continue
+
+        length = model.__table__.c[field].type.length
+        if value is not None and length is not None and len(value) > length:
+            errors.append(f'{field} must be at most {length} characters')
+            continue
+        values[field] = value
+
+    return values, errors
+
+
+def validate_artist_rows(rows):
+    fields = ('name', 'phone', 'styles', 'image_link', 'instagram_link', 'email')
+    validated = [validate_text_fields(Artist, row, fields, required=('name',))
+                 for row in rows]
+
+    # Artist names are unique, within the batch and in the database
+    names = [values['name'] for values, errors in validated if not errors]
+    taken = {name for name, in db.session.query(Artist.name).filter(
+                                                                    Artist.name.in_(names)
+                                                                    )}
+    seen = set()
+    for values, errors in validated:
+        if errors:
+            continue
+        if values['name'] in taken or values['name'] in seen:
+            errors.append('name already exists')
+        seen.add(values['name'])
+
+    return validated
+
+
+def validate_client_rows(rows):
+    fields = ('name', 'phone', 'email', 'address')
+    return [validate_text_fields(Client, row, fields, required=('name',))
+            for row in rows]
+
+
+def validate_appointment_rows(rows):
+    validated = []
+    for row in rows:
+        if not isinstance(row, dict):
+            validated.append((None, ['row must be a JSON object']))
+            continue
+
+        values = {}
+        errors = []
+        for field in ('artist', 'client'):
+            value = row.get(field, None)
+            if value is not None and (not isinstance(value, int)
+                                      or isinstance(value, bool)):
+                errors.append(f'{field} must be an id')
+            values[field] = value
+
+        appt_date = row.get('appointment_date', None)
+        if appt_date is None:
+            errors.append('appointment_date is required')
+        else:
+            try:
+                values['appointment_date'] = datetime.strptime(
+                                                               appt_date,
+                                                               "%a, %d %b %Y %H:%M:%S %Z"
+                                                               )
+            except (TypeError, ValueError):
+                errors.append('appointment_date is not a valid date')
+
+        values['duration'] = row.get('duration', APPOINTMENT_MINUTES)
+        if not valid_duration(values['duration']):
+            errors.append('duration must be between 1 and '
+                          f'{MAX_APPOINTMENT_MINUTES} minutes')
+        validated.append((values, errors))
+
+    # Look up every referenced artist and client with one query each
+    for field, model in (('artist', Artist), ('client', Client)):
+        ids = {values[field] for values, errors in validated
+               if not errors and values[field] is not None}
+        found = {id for id, in db.session.query(model.id).filter(
+                                                                 model.id.in_(ids)
+                                                                 )}
+        for values, errors in validated:
+            if not errors and values[field] is not None \
+                    and values[field] not in found:
+                errors.append(f'{field} {values[field]} does not exist')
+
+    check_booking_conflicts(validated)
+    return validated
+
+
+# Check the valid rows against the artists' existing appointments, read
+# with one range query, and against the earlier rows of the batch.
+# An artist's bookings never overlap, so each row only has to be compared
+# with the booking which starts before it ends
+def check_booking_conflicts(validated):
+    rows = [values for values, errors in validated
+            if not errors and values['artist'] is not None]
+    if not rows:
+        return
 
-# Format an appointment
-def format_appointment(appt_id):
-    appt = Appointment.query.get(appt_id)
-    return appt.format()
+    intervals = [(values['appointment_date'],
+                  values['appointment_date'] + timedelta(minutes=values['duration']))
+                 for values in rows]
+    existing = db.session.query(
+                                Appointment.artist,
+                                Appointment.appointment_date,
+                                Appointment.end_date,
+                                Appointment.id
+                                ).filter(
+                                         Appointment.artist.in_({values['artist'] for values in rows}),
+                                         Appointment.overlapping(min(start for start, end in intervals),
+                                                                 max(end for start, end in intervals))
+                                         ).order_by(Appointment.appointment_date)
+
+    bookings = {}
+    for artist, start, end, id in existing:
+        bookings.setdefault(artist, []).append((start, end, f'appointment {id}'))
+
+    for index, (values, errors) in enumerate(validated):
+        if errors or values['artist'] is None:
+            continue
+
+        start = values['appointment_date']
+        end = start + timedelta(minutes=values['duration'])
+        booked = bookings.setdefault(values['artist'], [])
+        position = bisect_left(booked, (end,))
+        if position > 0 and booked[position - 1][1] > start:
+            errors.append(f'overlaps {booked[position - 1][2]}')
+        else:
+            insort(booked, (start, end, f'row {index}'))
+
+
+# Validate every row up front and insert the batch in one transaction.
+# Returns the per row results and the HTTP status of the response
+def bulk_create(model, resource, validated):
+    if any(errors for values, errors in validated):
+        results = [{
+                    'index': index,
+                    'success': not errors,
+                    'errors': errors
+                    } for index, (values, errors) in enumerate(validated)]
+        return results, 422
+
+    rows = [values for values, errors in validated]
+    try:
+        ids = bulk_insert(model, rows)
+    except IntegrityError as error:
+        # A concurrent booking was committed after the rows were checked
+        db.session.rollback()
+        abort(409 if is_booking_conflict(error) else 422)
+    except Exception:
+        db.session.rollback()
+        abort(422)
+
+    results = []
+    for index, (values, id) in enumerate(zip(rows, ids)):
+        created = model(**values)
+        created.id = id
+        results.append({
+                        'index': index,
+                        'success': True,
+                        resource: created.format()
+                        })
+    return results, 200
 
 
 '''
@@ -93,9 +493,10 @@ def format_appointment(appt_id):
 
 def create_app(test_config=None):
 
-    # create and configure the app, database, and CORS headers
+    # create and configure the app, database, metrics and CORS headers
     app = Flask(__name__)
     setup_db(app)
+    setup_metrics(app, pool_stats)
 
     CORS(app, resources={r"/api/*": {"origins": "*"}})
 
@@ -111,84 +512,336 @@ def create_app(test_config=None):
     def index():
         return "Healthy"
 
+    health_checks = HealthChecks({
+                                  'database': ping_database,
+                                  'jwks': jwks_cache.check
+                                  })
+
+    # The worker is running and answers requests
+    @app.route('/health/live')
+    def health_live():
+        return jsonify({
+                        'success': True,
+                        'status': 'live'
+                        })
+
+    # The database and the signing keys are available, with the latency
+    # of each probe. Answers 503 when a probe fails
+    @app.route('/health/ready')
+    def health_ready():
+        ready, checks, age = health_checks.check()
+
+        return jsonify({
+                        'success': ready,
+                        'status': 'ready' if ready else 'unavailable',
+                        'checks': checks,
+                        'checked_seconds_ago': age
+                        }), 200 if ready else 503
+
     '''
     GET Endpoints for Artist, Client, Appointment
     '''
-    # Endpoint to GET all artists
+    # Endpoint to GET all artists, optionally only those with a style.
+    # Conditional requests are answered from the artists table version
     @app.route('/api/artists')
     def all_artists():
-        artists = [artist.format() for artist in Artist.query.all()]
+        style = get_search_arg(request, 'style')
 
-        return jsonify({
-                        'success': True,
-                        'artists': artists,
-                        'total_artists': len(artists)
-                        })
+        def build():
+            query = Artist.query
+            if style is not None:
+                query = query.filter(has_style(style))
+
+            artists = formatted_rows(query, Artist)
+
+            return json_response({
+                                   'success': True,
+                                   'artists': artists,
+                                   'total_artists': len(artists)
+                                   })
+
+        return conditional_response(ARTISTS, build)
 
     # Return a single artist according to artist id
-    @app.route('/api/artists/<artist_id>')
+    @app.route('/api/artists/<int:artist_id>')
     def single_artist(artist_id):
 
-        # Check for artist in database
-        check_for_artist(artist_id)
-        # Get the artist and return formatted artist
-        formatted_artist = format_artist(artist_id)
+        def build():
+            # Get the artist or 404 and return formatted artist
+            formatted_artist = get_or_404(Artist, artist_id).format()
+
+            return jsonify({
+                            'success': True,
+                            'artist': formatted_artist,
+                            })
+
+        return conditional_response(ARTISTS, build)
+
+    # Search artists by name, email, phone and styles, best matches first,
+    # and/or filter them by style
+    @app.route('/api/artists/search')
+    @cached(ARTISTS)
+    def search_artists():
+        terms = get_search_arg(request, 'q')
+        style = get_search_arg(request, 'style')
+        if terms is None and style is None:
+            abort(422)
+
+        if terms is not None:
+            query = search(Artist, terms)
+        else:
+            query = Artist.query.order_by(Artist.id)
+        if style is not None:
+            query = query.filter(has_style(style))
+
+        artists, next_page = paginate_search(request, query, Artist)
+
+        return json_response({
+                               'success': True,
+                               'artists': artists,
+                               'next_page': next_page
+                               })
+
+    # Return the free intervals of an artist between from and to which
+    # are at least duration minutes long. The booked appointments are read
+    # with a single range query and swept in order
+    @app.route('/api/artists/<int:artist_id>/availability')
+    @cached(ARTISTS, APPOINTMENTS)
+    def artist_availability(artist_id):
+        start = get_date_arg(request, 'from')
+        end = get_date_arg(request, 'to')
+        duration = get_duration(request)
+        if end <= start or end - start > timedelta(days=MAX_AVAILABILITY_DAYS):
+            abort(422)
+
+        get_or_404(Artist, artist_id)
+        appointments = Appointment.query.filter(
+                                                Appointment.artist == artist_id,
+                                                Appointment.overlapping(start, end)
+                                                ).order_by(Appointment.appointment_date).all()
+
+        busy = [(appt.appointment_date, appt.end_date) for appt in appointments]
+        free = free_intervals(busy, start, end, duration)
 
         return jsonify({
                         'success': True,
-                        'artist': formatted_artist,
+                        'artist': artist_id,
+                        'free': [{'start': free_start, 'end': free_end}
+                                 for free_start, free_end in free]
                         })
 
+    # Return the first artists, by id, who are free for duration minutes
+    # starting at the given time. Artists with an overlapping appointment
+    # are excluded by a NOT EXISTS on the indexed (artist, date) lookup
+    @app.route('/api/artists/available')
+    @cached(ARTISTS, APPOINTMENTS)
+    def available_artists():
+        start = get_date_arg(request, 'at')
+        end = start + get_duration(request)
+        limit = get_per_page(request, AVAILABLE_ARTISTS_PER_PAGE)
+
+        booked = db.session.query(Appointment.id).filter(
+                                                         Appointment.artist == Artist.id,
+                                                         Appointment.overlapping(start, end)
+                                                         ).exists()
+        artists = formatted_rows(Artist.query.filter(~booked).order_by(Artist.id).limit(limit),
+                                 Artist)
+
+        return json_response({
+                               'success': True,
+                               'artists': artists
+                               })
+
     # return all clients formatted
     @app.route('/api/clients')
     @requires_auth('get:all')
+    @cached(CLIENTS)
     def all_clients(payload):
 
-        clients = Client.query.all()
-        size = len(clients)
+        size = counter_cache.get('total_clients')
         if size == 0:
             abort(404)
 
-        formatted_clients = paginate_clients(request, clients)
+        formatted_clients, next_cursor = paginate_clients(request)
         if len(formatted_clients) == 0:
             abort(404)
 
-        return jsonify({
-                        'success': True,
-                        'clients': formatted_clients,
-                        'total_clients': size
-                        })
+        return json_response({
+                               'success': True,
+                               'clients': formatted_clients,
+                               'total_clients': size,
+                               'next_cursor': next_cursor
+                               })
+
+    # Search clients by name, email and phone, best matches first
+    @app.route('/api/clients/search')
+    @requires_auth('get:all')
+    @cached(CLIENTS)
+    def search_clients(payload):
+        terms = get_search_arg(request, 'q')
+        if terms is None:
+            abort(422)
+
+        clients, next_page = paginate_search(request, search(Client, terms), Client)
+
+        return json_response({
+                               'success': True,
+                               'clients': clients,
+                               'next_page': next_page
+                               })
 
     # Return a single client according to client id
-    @app.route('/api/clients/<client_id>')
+    @app.route('/api/clients/<int:client_id>')
     @requires_auth('get:all')
+    @cached(CLIENTS)
     def single_client(payload, client_id):
 
-        # Check for artist in database
-        check_for_client(client_id)
-        # Get the artist and return formatted artist
-        formatted_client = format_client(client_id)
+        # Get the client or 404 and return formatted client
+        formatted_client = get_or_404(Client, client_id).format()
 
         return jsonify({
                         'success': True,
                         'client': formatted_client
                         })
 
+    # Return a page of appointments ordered by date, optionally filtered
+    # by artist, client and a from/to date range. Pages are fetched with
+    # a keyset cursor so deep pages cost the same as the first one
+    @app.route('/api/appointments')
+    @requires_auth('get:all')
+    @cached(APPOINTMENTS, ARTISTS, CLIENTS)
+    def all_appointments(payload):
+        per_page = get_per_page(request, APPOINTMENTS_PER_PAGE)
+        expand = get_expand(request)
+        artist_id = request.args.get('artist', None, type=int)
+        client_id = request.args.get('client', None, type=int)
+        date_from = format_datetime(request.args.get('from', None))
+        date_to = format_datetime(request.args.get('to', None))
+        cursor = request.args.get('cursor', None)
+
+        query = Appointment.query
+        if artist_id is not None:
+            query = query.filter(Appointment.artist == artist_id)
+        if client_id is not None:
+            query = query.filter(Appointment.client == client_id)
+        if date_from is not None:
+            query = query.filter(Appointment.appointment_date >= date_from)
+        if date_to is not None:
+            query = query.filter(Appointment.appointment_date < date_to)
+
+        # Seek past the last appointment of the previous page
+        if cursor is not None:
+            last_date, last_id = decode_cursor(cursor, 2)
+            try:
+                last_date = datetime.fromisoformat(last_date)
+                last_id = int(last_id)
+            except (TypeError, ValueError):
+                abort(422)
+            query = query.filter(db.tuple_(
+                                           Appointment.appointment_date,
+                                           Appointment.id
+                                           ) > (last_date, last_id))
+
+        appointments = formatted_rows(query.order_by(
+                                                     Appointment.appointment_date,
+                                                     Appointment.id
+                                                     ).limit(per_page + 1),
+                                      Appointment, expand)
+
+        next_cursor = None
+        if len(appointments) > per_page:
+            appointments = appointments[:per_page]
+            last = appointments[-1]
+            next_cursor = encode_cursor([
+                                         last['appointment_date'].isoformat(),
+                                         last['id']
+                                         ])
+
+        return json_response({
+                               'success': True,
+                               'appointments': appointments,
+                               'next_cursor': next_cursor
+                               })
+
     # Return a single appointment according to id
-    @app.route('/api/appointments/<appt_id>')
+    @app.route('/api/appointments/<int:appt_id>')
     @requires_auth('get:appointment')
+    @cached(APPOINTMENTS, ARTISTS, CLIENTS)
     def single_appointment(payload, appt_id):
 
-        # Check for appointment in datbase
-        check_for_appointment(appt_id)
-        # Get appointment and return formatted appointment
-        formatted_appt = format_appointment(appt_id)
+        # Get appointment or 404 and return formatted appointment,
+        # embedding the artist and client when requested with ?expand=
+        expand = get_expand(request)
+        appt = get_or_404(Appointment, appt_id,
+                          Appointment.query_expanded(expand))
+        formatted_appt = appt.format(expand)
 
         return jsonify({
                         'success': True,
                         'appointment': formatted_appt
                         })
 
+    # Return the hit ratio and memory use of the response cache, and the
+    # hits and misses of the verified token cache
+    @app.route('/api/cache/stats')
+    @requires_auth('get:all')
+    def cache_stats(payload):
+
+        return jsonify({
+                        'success': True,
+                        'response_cache': response_cache.stats(),
+                        'token_cache': token_cache.stats()
+                        })
+
+    # Return the checkout latency and connection counts of the database
+    # connection pool of the worker which answers
+    @app.route('/api/pool/stats')
+    @requires_auth('get:all')
+    def database_pool_stats(payload):
+
+        return jsonify({
+                        'success': True,
+                        'pool': pool_stats()
+                        })
+
+    # Request, database and token verification metrics of every worker
+    # in the Prometheus text format
+    @app.route('/metrics')
+    def metrics():
+        rendered = render_metrics()
+        if rendered is None:
+            abort(404)
+
+        body, content_type = rendered
+        return Response(body, content_type=content_type)
+
+    # Stream every artist, client or appointment with an id above after,
+    # in id order, as NDJSON or CSV. An interrupted export is resumed by
+    # passing the last id received as after
+    @app.route('/api/export/<resource>')
+    @requires_auth('get:all')
+    def export(payload, resource):
+        model = EXPORT_MODELS.get(resource)
+        if model is None:
+            abort(404)
+
+        export_format = request.args.get('format', 'ndjson')
+        after = request.args.get('after', 0, type=int)
+        batches = iter_formatted(model, after, EXPORT_BATCH_SIZE)
+
+        if export_format == 'ndjson':
+            chunks = ndjson_chunks(batches)
+            mimetype = 'application/x-ndjson'
+        elif export_format == 'csv':
+            chunks = csv_chunks(model.format_columns, batches)
+            mimetype = 'text/csv'
+        else:
+            abort(422)
+
+        filename = '{}.{}'.format(resource, export_format)
+        return Response(stream_with_context(chunks), mimetype=mimetype,
+                        headers={'Content-Disposition': 'attachment; filename=' + filename})
+
     '''
     POST Endpoints for Artist, Client, Appointment
     '''
@@ -220,14 +873,10 @@ def create_app(test_config=None):
         except:
             abort(422)
 
-        # Find the new artist by getting the last instance of an artist
-        # matching the new_artist object name
-        posted_artist = Artist.query.filter(
-                                            Artist.name == new_artist.name
-                                            ).order_by(Artist.id).all()[-1]
-
-        formatted_artist = posted_artist.format()
-        total_artists = len(Artist.query.all())
+        # The insert returns the new artist's id, so the artist can be
+        # formatted without querying for it again
+        formatted_artist = new_artist.format()
+        total_artists = counter_cache.get('total_artists')
         return jsonify({
                         'success': True,
                         'artist': formatted_artist,
@@ -258,15 +907,11 @@ def create_app(test_config=None):
         except:
             abort(422)
 
-        # Find the new client by getting the last instance of a client
-        # matching the new_client object name
-        posted_client = Client.query.filter(
-                                            Client.name == new_client.name
-                                            ).order_by(Client.id).all()[-1]
+        # The insert returns the new client's id, so the client can be
+        # formatted without querying for it again
+        formatted_client = new_client.format()
 
-        formatted_client = posted_client.format()
-
-        total_clients = len(Client.query.all())
+        total_clients = counter_cache.get('total_clients')
         return jsonify({
                         'success': True,
                         'client': formatted_client,
@@ -282,58 +927,100 @@ def create_app(test_config=None):
         artist_id = body.get('artist', None)
         client_id = body.get('client', None)
         appt_date = body.get('appointment_date', None)
+        duration = body.get('duration', APPOINTMENT_MINUTES)
 
         # Appointment will not be created if it does not
         # include an appointment date
-        if appt_date is None:
+        if appt_date is None or not valid_duration(duration):
             abort(422)
 
         appointment_date = format_datetime(appt_date)
 
         new_appt = Appointment(client=client_id,
                                artist=artist_id,
-                               appointment_date=appointment_date
+                               appointment_date=appointment_date,
+                               duration=duration
                                )
-        # Insert the new appointment into the database
+        # Insert the new appointment into the database. Double bookings
+        # are rejected by the exclusion constraint on the table
         try:
             new_appt.insert()
+        except IntegrityError as error:
+            db.session.rollback()
+            if not is_booking_conflict(error):
+                abort(422)
+            return booking_conflict(artist_id, appointment_date, new_appt.end_date)
         except:
             return abort(422)
 
-        # Get the appointment in the database by matching the artist
-        # and appointment time
-        posted_appt = Appointment.query.filter(
-                                                Appointment.artist == new_appt.artist
-                                                ).filter(
-                                                        Appointment.appointment_date == new_appt.appointment_date
-                                                        ).order_by(Appointment.id).all()[-1]
-
-        formatted_appt = posted_appt.format()
-
-        # Return an array containing all upcoming appointments
-        now = datetime.now()
-        upcoming_appointments = Appointment.query.filter(
-                                                         Appointment.appointment_date > now
-                                                         ).all()
+        # The insert returns the new appointment's id, so the appointment
+        # can be formatted without querying for it again
+        formatted_appt = new_appt.format()
+
+        # Return the number of upcoming appointments
+        total_upcoming = counter_cache.get('total_upcoming_appointments')
         return jsonify({
                         'success': True,
                         'appointment': formatted_appt,
-                        'total_upcoming_appointments': len(upcoming_appointments)
+                        'total_upcoming_appointments': total_upcoming
                         })
 
+    '''
+    Bulk POST Endpoints for Artist, Client, Appointment
+    Accept a JSON array or NDJSON of up to BULK_MAX_BATCH_SIZE rows.
+    Nothing is inserted unless every row is valid
+    '''
+    def bulk_response(results, status, total_name):
+        if status != 200:
+            return jsonify({
+                            'success': False,
+                            'error': status,
+                            'message': 'Unprocessable Request',
+                            'results': results
+                            }), status
+
+        return jsonify({
+                        'success': True,
+                        'results': results,
+                        total_name: counter_cache.get(total_name)
+                        })
+
+    @app.route('/api/artists/bulk', methods=['POST'])
+    @requires_auth('create:artist')
+    def bulk_create_artists(payload):
+        validated = validate_artist_rows(get_bulk_rows(request))
+        results, status = bulk_create(Artist, 'artist', validated)
+
+        return bulk_response(results, status, 'total_artists')
+
+    @app.route('/api/clients/bulk', methods=['POST'])
+    @requires_auth('create:client')
+    def bulk_create_clients(payload):
+        validated = validate_client_rows(get_bulk_rows(request))
+        results, status = bulk_create(Client, 'client', validated)
+
+        return bulk_response(results, status, 'total_clients')
+
+    @app.route('/api/appointments/bulk', methods=['POST'])
+    @requires_auth('create:appointment')
+    def bulk_create_appointments(payload):
+        validated = validate_appointment_rows(get_bulk_rows(request))
+        results, status = bulk_create(Appointment, 'appointment', validated)
+
+        return bulk_response(results, status, 'total_upcoming_appointments')
+
     '''
     PATCH Endpoints for Artist, Client, Appointment
     '''
 
     # Patch endpoint for updating an artist
-    @app.route('/api/artists/<artist_id>', methods=['PATCH'])
+    @app.route('/api/artists/<int:artist_id>', methods=['PATCH'])
     @requires_auth('update:artist')
     def update_artist(payload, artist_id):
         body = request.get_json()
 
-        # Check database for client
-        check_for_artist(artist_id)
-        artist = Artist.query.get(artist_id)
+        # Get the artist from the database or 404
+        artist = get_or_404(Artist, artist_id)
 
         # Update artist values with new values if new values exist
         # Else keep old values
@@ -350,7 +1037,7 @@ def create_app(test_config=None):
         except:
             abort(422)
 
-        formatted_artist = format_artist(artist_id)
+        formatted_artist = artist.format()
 
         return jsonify({
                         'success': True,
@@ -358,14 +1045,13 @@ def create_app(test_config=None):
                         })
 
     # Patch endpoint for updating a client
-    @app.route('/api/clients/<client_id>', methods=['PATCH'])
+    @app.route('/api/clients/<int:client_id>', methods=['PATCH'])
     @requires_auth('update:client')
     def update_client(payload, client_id):
 
         body = request.get_json()
-        # Check database for client
-        check_for_client(client_id)
-        client = Client.query.get(client_id)
+        # Get the client from the database or 404
+        client = get_or_404(Client, client_id)
 
         # Update client with new values if value exists
         # Else keep old values
@@ -380,7 +1066,7 @@ def create_app(test_config=None):
         except:
             abort(422)
 
-        formatted_client = format_client(client_id)
+        formatted_client = client.format()
 
         return jsonify({
                         'success': True,
@@ -388,15 +1074,14 @@ def create_app(test_config=None):
                         })
 
     # Patch endpoint for updating an appointment
-    @app.route('/api/appointments/<appt_id>', methods=['PATCH'])
+    @app.route('/api/appointments/<int:appt_id>', methods=['PATCH'])
     @requires_auth('update:appointment')
     def update_appointment(payload, appt_id):
 
         body = request.get_json()
 
-        # Check database for appointment
-        check_for_appointment(appt_id)
-        appt = Appointment.query.get(appt_id)
+        # Get the appointment from the database or 404
+        appt = get_or_404(Appointment, appt_id)
 
         # Get artist from request and check database
         artist = body.get('artist', None)
@@ -417,13 +1102,29 @@ def create_app(test_config=None):
         # If body does not include a new appt date, keep the current appt date
         appt.appointment_date = date if date is not None else appt.appointment_date
 
+        # If body does not include a duration, keep the current duration
+        duration = body.get('duration', None)
+        if duration is not None:
+            if not valid_duration(duration):
+                abort(422)
+            appt.duration = duration
+
+        # The rollback after a failed update reloads the old values, so
+        # the booking is kept for the conflict lookup
+        booking = (appt.artist, appt.appointment_date, appt.end_date, appt.id)
+
         # Update appointment in database
         try:
             appt.update()
+        except IntegrityError as error:
+            db.session.rollback()
+            if not is_booking_conflict(error):
+                abort(422)
+            return booking_conflict(*booking)
         except:
             abort(422)
 
-        formatted_appt = format_appointment(appt_id)
+        formatted_appt = appt.format()
 
         return jsonify({
                         'success': True,
@@ -435,21 +1136,19 @@ def create_app(test_config=None):
     '''
 
     # DELETE endpoint for a single artist
-    @app.route('/api/artists/<artist_id>', methods=['DELETE'])
+    @app.route('/api/artists/<int:artist_id>', methods=['DELETE'])
     @requires_auth('delete:artist')
     def delete_artist(payload, artist_id):
 
-        # Check database for artist
-        check_for_artist(artist_id)
-        # Get artist and delete from database
-        artist = Artist.query.get(artist_id)
+        # Get artist or 404 and delete from database
+        artist = get_or_404(Artist, artist_id)
 
         try:
             artist.delete()
         except:
             abort(422)
 
-        total_artists = Artist.query.count()
+        total_artists = counter_cache.get('total_artists')
 
         return jsonify({
                         'success': True,
@@ -458,21 +1157,19 @@ def create_app(test_config=None):
                         })
 
     # DELETE endpoint for a single client
-    @app.route('/api/clients/<client_id>', methods=['DELETE'])
+    @app.route('/api/clients/<int:client_id>', methods=['DELETE'])
     @requires_auth('delete:client')
     def delete_client(payload, client_id):
 
-        # Check database for client
-        check_for_client(client_id)
-        # Get client and delete from database
-        client = Client.query.get(client_id)
+        # Get client or 404 and delete from database
+        client = get_or_404(Client, client_id)
 
         try:
             client.delete()
         except:
             abort(422)
 
-        total_clients = Client.query.count()
+        total_clients = counter_cache.get('total_clients')
 
         return jsonify({
                         'success': True,
@@ -481,28 +1178,23 @@ def create_app(test_config=None):
                         })
 
     # DELETE endpoint for a single appointment
-    @app.route('/api/appointments/<appt_id>', methods=['DELETE'])
+    @app.route('/api/appointments/<int:appt_id>', methods=['DELETE'])
     @requires_auth('delete:appointment')
     def delete_appointment(payload, appt_id):
 
-        # Check database for appointment
-        check_for_appointment(appt_id)
-        # Get appointment and delete from database
-        appt = Appointment.query.get(appt_id)
+        # Get appointment or 404 and delete from database
+        appt = get_or_404(Appointment, appt_id)
 
         try:
             appt.delete()
         except:
             abort(422)
-        now = datetime.now()
-        upcoming_appointments = Appointment.query.filter(
-                                                         Appointment.appointment_date > now
-                                                        ).all()
+        total_upcoming = counter_cache.get('total_upcoming_appointments')
 
         return jsonify({
                         'success': True,
                         'deleted_appointment_id': appt.id,
-                        'total_upcoming_appointments': len(upcoming_appointments)
+                        'total_upcoming_appointments': total_upcoming
                         })
 
     '''
@@ -540,6 +1232,22 @@ def create_app(test_config=None):
             'message': 'Resource Not Found',
         }), 404
 
+    @app.errorhandler(409)
+    def conflict(error):
+        return jsonify({
+            'success': False,
+            'error': 409,
+            'message': 'Conflict'
+        }), 409
+
+    @app.errorhandler(413)
+    def request_too_large(error):
+        return jsonify({
+            'success': False,
+            'error': 413,
+            'message': 'Request Too Large'
+        }), 413
+
     @app.errorhandler(422)
     def unprocessable_request(error):
         return jsonify({
@@ -548,6 +1256,17 @@ def create_app(test_config=None):
             'message': 'Unprocessable Request'
         }), 422
 
+    # Token and signing key errors raised by requires_auth, such as a
+    # 503 while the Auth0 signing keys can not be fetched
+    @app.errorhandler(AuthError)
+    def auth_error(error):
+        return jsonify({
+            'success': False,
+            'error': error.status_code,
+            'code': error.error['code'],
+            'message': error.error['description']
+        }), error.status_code
+
     @app.errorhandler(500)
     def unprocessable_request(error):
         return jsonify({
@@ -1,15 +1,31 @@
 import os
 import json
+import hashlib
+import threading
+import time
 from flask import Flask, request, jsonify, _request_ctx_stack, abort
 from flask_cors import cross_origin
+from collections import OrderedDict
 from functools import wraps
-from jose import jwt
+from jose import jwk, jwt
+from jose.exceptions import JWKError
 from urllib.request import urlopen
+from metrics import auth_timer, count_token_cache
 
 AUTH0_DOMAIN = os.environ.get('AUTH0_DOMAIN')
 ALGORITHMS = [os.environ.get('ALGORITHMS')]
 API_AUDIENCE = os.environ.get('API_AUDIENCE')
 
+# JWKS source and cache settings
+JWKS_URL = os.environ.get('JWKS_URL')
+JWKS_CACHE_TTL = int(os.environ.get('JWKS_CACHE_TTL', 3600))
+JWKS_REFRESH_INTERVAL = int(os.environ.get('JWKS_REFRESH_INTERVAL', 30))
+JWKS_FETCH_TIMEOUT = int(os.environ.get('JWKS_FETCH_TIMEOUT', 5))
+
+# Verified token cache settings
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 300))
+
 # AuthError Exception
 '''
 AuthError Exception
@@ -71,6 +87,173 @@ def check_permissions(permission, payload):
     return True
 
 
+'''
+JWKS key store
+Loads the signing keys once per process, indexes them by kid and
+refetches them when they expire or a token carries an unknown kid.
+Expired keys are refetched in the background while requests keep being
+verified with them, so only the first load and unknown kids wait on a fetch
+'''
+
+
+# Fetch the JWKS document from Auth0, or from JWKS_URL when set
+# (file:// urls are supported for local key sets)
+def fetch_jwks():
+    url = JWKS_URL or f'https://{AUTH0_DOMAIN}/.well-known/jwks.json'
+    jsonurl = urlopen(url, timeout=JWKS_FETCH_TIMEOUT)
+    return json.loads(jsonurl.read())
+
+
+# Construct a public key object per kid, so tokens are verified
+# without re-parsing the modulus and exponent on every request
+def construct_keys(jwks):
+    keys = {}
+    for key in jwks.get('keys', []):
+        if 'kid' not in key:
+            continue
+        try:
+            keys[key['kid']] = jwk.construct(key, key.get('alg') or ALGORITHMS[0])
+        except JWKError:
+            continue
+
+    return keys
+
+
+# Build a fetcher which reads the JWKS document from a local file
+def jwks_file_fetcher(path):
+    def fetch():
+        with open(path) as jwks_file:
+            return json.load(jwks_file)
+
+    return fetch
+
+
+# Run target in a daemon thread, a greenlet under the gevent worker
+def spawn_thread(target):
+    threading.Thread(target=target, daemon=True).start()
+
+
+class JWKSCache:
+    def __init__(self, fetcher=fetch_jwks, ttl=JWKS_CACHE_TTL,
+                 refresh_interval=JWKS_REFRESH_INTERVAL, clock=time.monotonic,
+                 spawn=spawn_thread):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self.spawn = spawn
+        self._keys = {}
+        self._loaded_at = None
+        self._last_fetch = None
+        self._fetches = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._refreshing_lock = threading.Lock()
+
+    # Swap the key source and drop any keys loaded from the old one
+    def set_fetcher(self, fetcher):
+        with self._lock:
+            self.fetcher = fetcher
+            self._keys = {}
+            self._loaded_at = None
+            self._last_fetch = None
+
+    def is_stale(self):
+        if self._loaded_at is None:
+            return True
+        return self.clock() - self._loaded_at >= self.ttl
+
+    # Refetch the key set. Fetches are rate limited to one per
+    # refresh_interval and a failed fetch keeps the current keys.
+    # fetches is the number of fetches the caller saw before deciding to
+    # refresh; when another fetch was made since, its keys are used
+    # instead of fetching again
+    def refresh(self, force=False, fetches=None):
+        if fetches is None:
+            fetches = self._fetches
+        with self._lock:
+            if self._fetches != fetches:
+                return self._loaded_at is not None
+
+            now = self.clock()
+            if (not force and self._last_fetch is not None
+                    and now - self._last_fetch < self.refresh_interval):
+                return False
+
+            self._last_fetch = now
+            try:
+                with auth_timer('jwks_fetch'):
+                    jwks = self.fetcher()
+            except Exception:
+                return False
+            finally:
+                self._fetches += 1
+
+            self._keys = construct_keys(jwks)
+            self._loaded_at = now
+            return True
+
+    # Start a refresh in the background unless one is already running
+    def refresh_in_background(self):
+        with self._refreshing_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing = False
+
+        self.spawn(run)
+
+    # Load the keys when none are loaded yet, or refresh expired keys in
+    # the background
+    def _ensure_loaded(self, fetches):
+        if self._loaded_at is None:
+            self.refresh(fetches=fetches)
+        elif self.is_stale():
+            self.refresh_in_background()
+
+    def _raise_if_empty(self):
+        if not self._keys:
+            raise AuthError({
+                'code': 'jwks_unavailable',
+                'description': 'Unable to fetch the signing keys.'
+            }, 503)
+
+    # Return the key object for kid or None if the key set does not have it
+    def get_key(self, kid):
+        fetches = self._fetches
+        self._ensure_loaded(fetches)
+
+        key = self._keys.get(kid)
+        if key is None and self._loaded_at is not None:
+            self.refresh(fetches=fetches)
+            key = self._keys.get(kid)
+
+        self._raise_if_empty()
+        return key
+
+    # Readiness check of the key set: loads it as a token check would and
+    # returns the number of keys and their age in seconds. Expired keys
+    # are still served, so they are reported as stale but pass the check
+    def check(self):
+        self._ensure_loaded(self._fetches)
+        self._raise_if_empty()
+
+        return {
+            'keys': len(self._keys),
+            'age_seconds': self.clock() - self._loaded_at,
+            'stale': self.is_stale()
+        }
+
+
+jwks_cache = JWKSCache()
+
+
 '''
 Token decoder to validate the token uses Auth0 and
 return the decoded payload
@@ -78,34 +261,24 @@ return the decoded payload
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-    if rsa_key:
+    rsa_key = jwks_cache.get_key(unverified_header['kid'])
+    if rsa_key is not None:
         try:
-            payload = jwt.decode(
-                token,
-                rsa_key,
-                algorithms=ALGORITHMS,
-                audience=API_AUDIENCE,
-                issuer='https://' + AUTH0_DOMAIN + '/'
-            )
+            with auth_timer('jwt_decode'):
+                payload = jwt.decode(
+                    token,
+                    rsa_key,
+                    algorithms=ALGORITHMS,
+                    audience=API_AUDIENCE,
+                    issuer='https://' + AUTH0_DOMAIN + '/'
+                )
             return payload
 
         except jwt.ExpiredSignatureError:
@@ -130,6 +303,85 @@ def verify_decode_jwt(token):
             }, 400)
 
 
+'''
+Verified token cache
+Bounded LRU of decoded payloads keyed by a hash of the raw token so
+repeated requests with the same bearer token skip signature checks
+'''
+
+
+class TokenCache:
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL,
+                 clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    # Return the cached payload for token, or None if absent or expired.
+    # Lookups are also counted in the auth_token_cache metrics
+    def get(self, token):
+        key = self._key(token)
+        payload = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self.clock() < entry[1]:
+                    self._entries.move_to_end(key)
+                    payload = entry[0]
+                else:
+                    del self._entries[key]
+            if payload is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        count_token_cache(payload is not None)
+        return payload
+
+    # Cache payload until the earlier of the token exp and the cache ttl
+    def set(self, token, payload):
+        if self.maxsize <= 0:
+            return
+
+        expires_at = self.clock() + self.ttl
+        if 'exp' in payload:
+            expires_at = min(expires_at, payload['exp'])
+        if expires_at <= self.clock():
+            return
+
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (payload, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize
+        }
+
+
+token_cache = TokenCache()
+
+
 '''
 Requires Authorization decorator method used to validate requests
 '''
@@ -139,9 +391,13 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            with auth_timer('requires_auth'):
+                token = get_token_auth_header()
+                payload = token_cache.get(token)
+                if payload is None:
+                    payload = verify_decode_jwt(token)
+                    token_cache.set(token, payload)
+                check_permissions(permission, payload)
             return f(payload, *args, **kwargs)
 
         return wrapper
@@ -0,0 +1,129 @@
+'''
+Load test for concurrent appointment booking
+
+Worker threads post bookings for a small pool of artists at the same
+time, so a share of the requests race for the same slots. Every slot
+should be booked exactly once, with the losing requests answered 409
+by the exclusion constraint on the appointment table.
+
+Needs a database with the current schema in DATABASE_URL. The artists,
+client and appointments it creates are removed afterwards.
+Run from the backend directory:
+    python -m benchmarks.bench_booking --workers 16 --requests 50
+'''
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault('AUTH0_DOMAIN', 'tattoo-api.test')
+os.environ.setdefault('ALGORITHMS', 'RS256')
+os.environ.setdefault('API_AUDIENCE', 'https://tattoo-api')
+
+from app import create_app
+from auth import auth
+from benchmarks.keys import make_signing_key, make_token
+from models import db, Artist, Client, Appointment
+
+FIRST_SLOT = datetime(2040, 1, 1, 9, 0)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=50,
+                        help='bookings posted by each worker')
+    parser.add_argument('--artists', type=int, default=4)
+    parser.add_argument('--slots', type=int, default=100,
+                        help='hourly slots per artist the workers pick from')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    private_key, jwk = make_signing_key()
+    auth.jwks_cache.set_fetcher(lambda: {'keys': [jwk]})
+    token = make_token(private_key, jwk['kid'], auth.AUTH0_DOMAIN,
+                       auth.API_AUDIENCE, ['create:appointment'])
+    headers = {'Authorization': 'Bearer ' + token}
+
+    app = create_app()
+    with app.app_context():
+        suffix = datetime.now().strftime('%H%M%S%f')
+        artists = [Artist(name=f'Booking Bench {i} {suffix}')
+                   for i in range(args.artists)]
+        client = Client(name='Booking Bench ' + suffix)
+        db.session.add_all(artists + [client])
+        db.session.commit()
+        artist_ids = [artist.id for artist in artists]
+        client_id = client.id
+
+    results = []
+    barrier = threading.Barrier(args.workers)
+
+    def work(seed):
+        rng = random.Random(seed)
+        test_client = app.test_client()
+        barrier.wait()
+        for _ in range(args.requests):
+            # Half hour offsets make neighbouring bookings overlap as well
+            start = FIRST_SLOT + timedelta(minutes=30 * rng.randrange(args.slots * 2))
+            payload = {
+                       'artist': rng.choice(artist_ids),
+                       'client': client_id,
+                       'appointment_date': start.strftime('%a, %d %b %Y %H:%M:%S GMT')
+                       }
+            began = time.perf_counter()
+            res = test_client.post('/api/appointments', json=payload,
+                                   headers=headers)
+            results.append((res.status_code, time.perf_counter() - began))
+
+    threads = [threading.Thread(target=work, args=(args.seed + i,))
+               for i in range(args.workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        overlaps = db.session.execute(
+            'SELECT count(*) FROM appointment a JOIN appointment b '
+            'ON a.artist = b.artist AND a.id < b.id '
+            "AND a.appointment_date < b.appointment_date + b.duration * interval '1 minute' "
+            "AND b.appointment_date < a.appointment_date + a.duration * interval '1 minute' "
+            'WHERE a.artist IN :artists', {'artists': tuple(artist_ids)}
+        ).scalar()
+
+        Appointment.query.filter(Appointment.artist.in_(artist_ids)).delete(
+                                                         synchronize_session=False)
+        Artist.query.filter(Artist.id.in_(artist_ids)).delete(synchronize_session=False)
+        Client.query.filter(Client.id == client_id).delete(synchronize_session=False)
+        db.session.commit()
+
+    latencies = [latency * 1000 for status, latency in results]
+    statuses = {}
+    for status, latency in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    print(json.dumps({
+                      'workers': args.workers,
+                      'requests': len(results),
+                      'statuses': statuses,
+                      'requests_per_second': len(results) / elapsed,
+                      'p50_ms': percentile(latencies, 0.5),
+                      'p95_ms': percentile(latencies, 0.95),
+                      'p99_ms': percentile(latencies, 0.99),
+                      'overlapping_bookings': overlaps
+                      }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
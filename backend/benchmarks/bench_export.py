@@ -0,0 +1,88 @@
+'''
+Benchmark for streaming exports of a large clients table
+
+Seeds synthetic clients, then reads GET /api/export/clients chunk by
+chunk, as a reporting job would, and reports the rows per second and
+the peak memory allocated by Python while streaming. The peak should not
+grow with --rows.
+
+Needs a database with the current schema in DATABASE_URL. The clients
+it creates are removed afterwards.
+Run from the backend directory:
+    python -m benchmarks.bench_export --rows 1000000 --format csv
+'''
+import argparse
+import json
+import os
+import time
+import tracemalloc
+from datetime import datetime
+
+os.environ.setdefault('AUTH0_DOMAIN', 'tattoo-api.test')
+os.environ.setdefault('ALGORITHMS', 'RS256')
+os.environ.setdefault('API_AUDIENCE', 'https://tattoo-api')
+
+from app import create_app
+from auth import auth
+from benchmarks.keys import make_signing_key, make_token
+from models import db, table_written, Client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson')
+    args = parser.parse_args()
+
+    private_key, jwk = make_signing_key()
+    auth.jwks_cache.set_fetcher(lambda: {'keys': [jwk]})
+    token = make_token(private_key, jwk['kid'], auth.AUTH0_DOMAIN,
+                       auth.API_AUDIENCE, ['get:all'])
+
+    app = create_app()
+    prefix = 'Export Bench {} '.format(datetime.now().strftime('%H%M%S%f'))
+    with app.app_context():
+        db.session.execute(
+            "INSERT INTO clients (name, phone, email, address) "
+            "SELECT :prefix || i, '555-010-' || lpad(mod(i, 10000)::text, 4, '0'), "
+            "'client' || i || '@example.com', i || ' Main Street' "
+            "FROM generate_series(1, :rows) AS i",
+            {'prefix': prefix, 'rows': args.rows})
+        db.session.commit()
+        table_written(Client.__table__.name)
+
+    try:
+        tracemalloc.start()
+        started = time.perf_counter()
+        res = app.test_client().get('/api/export/clients?format=' + args.format,
+                                    headers={'Authorization': 'Bearer ' + token},
+                                    buffered=False)
+        lines = 0
+        exported_bytes = 0
+        for chunk in res.response:
+            lines += chunk.count(b'\n')
+            exported_bytes += len(chunk)
+        res.close()
+        elapsed = time.perf_counter() - started
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        with app.app_context():
+            Client.query.filter(Client.name.startswith(prefix)).delete(
+                                                     synchronize_session=False)
+            db.session.commit()
+            table_written(Client.__table__.name)
+
+    rows = lines - 1 if args.format == 'csv' else lines
+    print(json.dumps({
+                      'format': args.format,
+                      'status': res.status_code,
+                      'rows': rows,
+                      'exported_mb': exported_bytes / 2 ** 20,
+                      'rows_per_second': rows / elapsed,
+                      'peak_python_memory_mb': peak / 2 ** 20
+                      }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
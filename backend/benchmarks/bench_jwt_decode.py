@@ -0,0 +1,79 @@
+'''
+Micro-benchmark for the per-request cost of verify_decode_jwt
+
+Compares the old path, which scanned the key set and rebuilt an rsa_key
+dict for python-jose to parse on every request, with the key objects the
+JWKS cache now constructs once per kid.
+
+Run from the backend directory:
+    python -m benchmarks.bench_jwt_decode --iterations 2000
+'''
+import argparse
+import json
+import os
+import time
+
+os.environ.setdefault('AUTH0_DOMAIN', 'tattoo-api.test')
+os.environ.setdefault('ALGORITHMS', 'RS256')
+os.environ.setdefault('API_AUDIENCE', 'https://tattoo-api')
+
+from jose import jwt
+
+from auth import auth
+from benchmarks.keys import make_signing_key, make_token
+
+
+# The rsa_key dict lookup verify_decode_jwt did before keys were cached
+def decode_with_key_dicts(token, jwks):
+    unverified_header = jwt.get_unverified_header(token)
+    rsa_key = {}
+    for key in jwks['keys']:
+        if key['kid'] == unverified_header['kid']:
+            rsa_key = {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key['use'],
+                'n': key['n'],
+                'e': key['e']
+            }
+    return jwt.decode(token, rsa_key, algorithms=auth.ALGORITHMS,
+                      audience=auth.API_AUDIENCE,
+                      issuer='https://' + auth.AUTH0_DOMAIN + '/')
+
+
+def time_per_call(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--keys', type=int, default=2,
+                        help='number of keys in the JWKS document')
+    args = parser.parse_args()
+
+    signing_keys = [make_signing_key(f'bench-key-{i}') for i in range(args.keys)]
+    private_key, last_jwk = signing_keys[-1]
+    jwks = {'keys': [jwk for _, jwk in signing_keys]}
+    token = make_token(private_key, last_jwk['kid'], auth.AUTH0_DOMAIN,
+                       auth.API_AUDIENCE, ['get:all'])
+
+    auth.jwks_cache.set_fetcher(lambda: jwks)
+    auth.verify_decode_jwt(token)
+
+    results = {
+        'iterations': args.iterations,
+        'keys': args.keys,
+        'key_dicts_us': time_per_call(
+            lambda: decode_with_key_dicts(token, jwks), args.iterations),
+        'cached_key_objects_us': time_per_call(
+            lambda: auth.verify_decode_jwt(token), args.iterations)
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,394 @@
+'''
+Benchmark of every route of the app on a seeded dataset
+
+Seeds synthetic artists, clients and appointments at the requested
+scale, signs tokens with a local key served by a stand-in JWKS, then
+sends --requests requests to each route from --concurrency threads.
+Reads run first, then creates, updates and finally deletes of the rows
+the creates made. Reports the throughput, latency percentiles and SQL
+statements per request of each route as JSON, which can be diffed
+between commits or compared with --baseline. Routes without a request
+below are listed under unbenchmarked_routes.
+
+The response cache is off unless RESPONSE_CACHE_BACKEND is set, so
+every request reaches the database.
+
+Needs a database with the current schema in DATABASE_URL. The seeded
+rows are reused by later runs with --keep and removed otherwise.
+Run from the backend directory:
+    python -m benchmarks.bench_routes --scale medium --output before.json
+    python -m benchmarks.bench_routes --scale medium --baseline before.json
+'''
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+os.environ.setdefault('AUTH0_DOMAIN', 'tattoo-api.test')
+os.environ.setdefault('ALGORITHMS', 'RS256')
+os.environ.setdefault('API_AUDIENCE', 'https://tattoo-api')
+os.environ.setdefault('RESPONSE_CACHE_BACKEND', 'off')
+
+from sqlalchemy import event
+from werkzeug.http import http_date
+from app import create_app
+from auth import auth
+from benchmarks.keys import make_signing_key, make_token
+from models import db, table_written, Artist, Client, Appointment
+
+# Clients and appointments seeded at each scale, with one artist per
+# 100 clients
+SCALES = {'small': 1000, 'medium': 100000, 'large': 1000000}
+STYLES = ('traditional', 'neo-traditional', 'japanese', 'blackwork',
+          'realism', 'watercolor', 'dotwork', 'tribal')
+# Seeded appointments are booked hourly per artist from SEED_START,
+# those created by the benchmark from WRITE_START
+SEED_START = datetime(2030, 1, 1, 0, 0)
+WRITE_START = datetime(2040, 1, 1, 0, 0)
+EXPORT_ROWS = 1000
+PERMISSIONS = ['create:appointment', 'create:artist', 'create:client',
+               'delete:appointment', 'delete:artist', 'delete:client',
+               'get:all', 'get:appointment', 'update:appointment',
+               'update:artist', 'update:client']
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+# Insert the dataset unless rows named with prefix already exist.
+# Returns the ids of the seeded artists, clients and appointments
+def seed(prefix, artists, clients, appointments):
+    pattern = prefix + '%'
+    if not db.session.query(Client.query.filter(Client.name.like(pattern)).exists()).scalar():
+        log('Seeding {} artists, {} clients and {} appointments'.format(
+            artists, clients, appointments))
+        params = {'prefix': prefix, 'pattern': pattern, 'artists': artists,
+                  'clients': clients, 'appointments': appointments,
+                  'styles': list(STYLES), 'start': SEED_START}
+        db.session.execute(
+            "INSERT INTO artists (name, phone, styles, email, image_link, instagram_link) "
+            "SELECT :prefix || 'Artist ' || i, '555-010-' || lpad(mod(i, 10000)::text, 4, '0'), "
+            "(:styles)[1 + mod(i, cardinality(:styles))], 'artist' || i || '@example.com', "
+            "'https://example.com/' || i || '.jpg', 'https://instagram.com/artist' || i "
+            "FROM generate_series(1, :artists) AS i", params)
+        db.session.execute(
+            "INSERT INTO styles (name) SELECT unnest(:styles) ON CONFLICT DO NOTHING", params)
+        db.session.execute(
+            "INSERT INTO artist_styles (artist_id, style_id) "
+            "SELECT artists.id, styles.id FROM artists JOIN styles ON styles.name = artists.styles "
+            "WHERE artists.name LIKE :pattern", params)
+        db.session.execute(
+            "INSERT INTO clients (name, phone, email, address) "
+            "SELECT :prefix || 'Client ' || i, '555-020-' || lpad(mod(i, 10000)::text, 4, '0'), "
+            "'client' || i || '@example.com', i || ' Main Street' "
+            "FROM generate_series(1, :clients) AS i", params)
+        db.session.execute(
+            "INSERT INTO appointment (artist, client, appointment_date, duration) "
+            "SELECT a.id, c.id, :start + (i / :artists) * interval '1 hour', 60 "
+            "FROM generate_series(0, :appointments - 1) AS i "
+            "JOIN (SELECT id, row_number() OVER (ORDER BY id) - 1 AS n FROM artists "
+            "      WHERE name LIKE :pattern) AS a ON a.n = mod(i, :artists) "
+            "JOIN (SELECT id, row_number() OVER (ORDER BY id) - 1 AS n FROM clients "
+            "      WHERE name LIKE :pattern) AS c ON c.n = mod(i, :clients)", params)
+        db.session.commit()
+        for table in ('artists', 'clients', 'appointment'):
+            db.session.execute('ANALYZE ' + table)
+            table_written(table)
+        db.session.commit()
+
+    artist_ids = [id for id, in db.session.query(Artist.id)
+                  .filter(Artist.name.like(pattern)).order_by(Artist.id)]
+    client_ids = [id for id, in db.session.query(Client.id)
+                  .filter(Client.name.like(pattern)).order_by(Client.id)]
+    appointment_ids = [id for id, in db.session.query(Appointment.id)
+                       .filter(Appointment.artist.in_(db.session.query(Artist.id)
+                               .filter(Artist.name.like(pattern))))
+                       .order_by(Appointment.id)]
+    return artist_ids, client_ids, appointment_ids
+
+
+# Remove the seeded rows and the rows created by the benchmark
+def clean_up(prefix):
+    pattern = prefix + '%'
+    artists = db.session.query(Artist.id).filter(Artist.name.like(pattern))
+    clients = db.session.query(Client.id).filter(Client.name.like(pattern))
+    Appointment.query.filter(db.or_(Appointment.artist.in_(artists),
+                                    Appointment.client.in_(clients))).delete(
+                                                     synchronize_session=False)
+    Artist.query.filter(Artist.name.like(pattern)).delete(synchronize_session=False)
+    Client.query.filter(Client.name.like(pattern)).delete(synchronize_session=False)
+    db.session.commit()
+    for table in ('artists', 'clients', 'appointment'):
+        table_written(table)
+
+
+# The request of each route, by method and rule. Each function takes the
+# number of the request and the shared state and returns the URL and
+# JSON body. Requests run in this order
+def route_requests(prefix, state, bulk_rows):
+    artists, clients, appointments = state['artists'], state['clients'], state['appointments']
+    slots = itertools.count()
+
+    def pick(ids, i):
+        return ids[(i * 7919) % len(ids)]
+
+    def day(i, days=0):
+        return quote(http_date(SEED_START + timedelta(days=i % 28 + days)))
+
+    def new_slot():
+        slot = next(slots)
+        start = WRITE_START + timedelta(hours=slot // len(artists))
+        return artists[slot % len(artists)], http_date(start)
+
+    def new_appointment(i):
+        artist, date = new_slot()
+        return {'artist': artist, 'client': pick(clients, i), 'appointment_date': date}
+
+    def created(name):
+        return state['created_' + name].pop()
+
+    return [
+        ('GET', '/', lambda i: ('/', None)),
+        ('GET', '/health/live', lambda i: ('/health/live', None)),
+        ('GET', '/health/ready', lambda i: ('/health/ready', None)),
+        ('GET', '/metrics', lambda i: ('/metrics', None)),
+        ('GET', '/api/artists', lambda i: ('/api/artists', None)),
+        ('GET', '/api/artists/<int:artist_id>',
+         lambda i: ('/api/artists/{}'.format(pick(artists, i)), None)),
+        ('GET', '/api/artists/search',
+         lambda i: ('/api/artists/search?q=' + quote('artist {}'.format(i)), None)),
+        ('GET', '/api/artists/<int:artist_id>/availability',
+         lambda i: ('/api/artists/{}/availability?from={}&to={}'.format(
+             pick(artists, i), day(i), day(i, 7)), None)),
+        ('GET', '/api/artists/available',
+         lambda i: ('/api/artists/available?at={}'.format(day(i)), None)),
+        ('GET', '/api/clients', lambda i: ('/api/clients?page={}'.format(1 + i % 50), None)),
+        ('GET', '/api/clients/search',
+         lambda i: ('/api/clients/search?q=client{}'.format(1 + i % len(clients)), None)),
+        ('GET', '/api/clients/<int:client_id>',
+         lambda i: ('/api/clients/{}'.format(pick(clients, i)), None)),
+        ('GET', '/api/appointments',
+         lambda i: ('/api/appointments?artist={}&expand=artist,client'.format(
+             pick(artists, i)), None)),
+        ('GET', '/api/appointments/<int:appt_id>',
+         lambda i: ('/api/appointments/{}?expand=artist,client'.format(
+             pick(appointments, i)), None)),
+        ('GET', '/api/cache/stats', lambda i: ('/api/cache/stats', None)),
+        ('GET', '/api/pool/stats', lambda i: ('/api/pool/stats', None)),
+        ('GET', '/api/export/<resource>',
+         lambda i: ('/api/export/{}?after={}'.format(
+             ('artists', 'clients', 'appointments')[i % 3],
+             max(0, (artists, clients, appointments)[i % 3][-1] - EXPORT_ROWS)), None)),
+        ('POST', '/api/artists',
+         lambda i: ('/api/artists', {'name': prefix + 'New Artist {}'.format(i),
+                                     'styles': 'Blackwork, Dotwork'})),
+        ('POST', '/api/clients',
+         lambda i: ('/api/clients', {'name': prefix + 'New Client {}'.format(i),
+                                     'email': 'new{}@example.com'.format(i)})),
+        ('POST', '/api/appointments', lambda i: ('/api/appointments', new_appointment(i))),
+        ('POST', '/api/artists/bulk',
+         lambda i: ('/api/artists/bulk', [{'name': prefix + 'Bulk Artist {}-{}'.format(i, j)}
+                                          for j in range(bulk_rows)])),
+        ('POST', '/api/clients/bulk',
+         lambda i: ('/api/clients/bulk', [{'name': prefix + 'Bulk Client {}-{}'.format(i, j)}
+                                          for j in range(bulk_rows)])),
+        ('POST', '/api/appointments/bulk',
+         lambda i: ('/api/appointments/bulk', [new_appointment(i + j)
+                                               for j in range(bulk_rows)])),
+        ('PATCH', '/api/artists/<int:artist_id>',
+         lambda i: ('/api/artists/{}'.format(pick(artists, i)),
+                    {'phone': '555-030-{:04d}'.format(i % 10000)})),
+        ('PATCH', '/api/clients/<int:client_id>',
+         lambda i: ('/api/clients/{}'.format(pick(clients, i)),
+                    {'phone': '555-040-{:04d}'.format(i % 10000)})),
+        ('PATCH', '/api/appointments/<int:appt_id>',
+         lambda i: ('/api/appointments/{}'.format(pick(appointments, i)), {'duration': 60})),
+        ('DELETE', '/api/appointments/<int:appt_id>',
+         lambda i: ('/api/appointments/{}'.format(created('appointment')), None)),
+        ('DELETE', '/api/artists/<int:artist_id>',
+         lambda i: ('/api/artists/{}'.format(created('artist')), None)),
+        ('DELETE', '/api/clients/<int:client_id>',
+         lambda i: ('/api/clients/{}'.format(created('client')), None))
+    ]
+
+
+# Keep the ids of created rows for the delete requests
+def record_created(state, data):
+    for item in data.get('results', [data]):
+        for name in ('artist', 'client', 'appointment'):
+            if isinstance(item.get(name), dict):
+                state['created_' + name].append(item[name]['id'])
+
+
+def run_route(app, headers, method, make_request, state, requests, concurrency, queries):
+    counter = itertools.count()
+    results = []
+
+    def work():
+        test_client = app.test_client()
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            url, body = make_request(i)
+            queries.count = 0
+            began = time.perf_counter()
+            res = test_client.open(url, method=method, json=body, headers=headers)
+            data = res.get_data()
+            elapsed = time.perf_counter() - began
+            results.append((res.status_code, elapsed * 1000, queries.count))
+            if method == 'POST' and res.status_code == 200:
+                record_created(state, json.loads(data))
+
+    threads = [threading.Thread(target=work) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    statuses = {}
+    for status, latency, count in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    latencies = [latency for status, latency, count in results]
+    counts = [count for status, latency, count in results]
+
+    return {
+            'requests': len(results),
+            'statuses': statuses,
+            'requests_per_second': len(results) / elapsed,
+            'p50_ms': percentile(latencies, 0.5),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'queries_per_request': sum(counts) / len(counts),
+            'max_queries': max(counts)
+            }
+
+
+# Relative change of each route against a previous report
+def compare(routes, baseline):
+    changes = {}
+    for name, result in routes.items():
+        before = baseline.get('routes', {}).get(name)
+        if before is None:
+            continue
+        changes[name] = {
+                         'requests_per_second': (result['requests_per_second']
+                                                 / before['requests_per_second'] - 1),
+                         'p99_ms': result['p99_ms'] / before['p99_ms'] - 1,
+                         'queries_per_request': (result['queries_per_request']
+                                                 - before['queries_per_request'])
+                         }
+    return changes
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--clients', type=int)
+    parser.add_argument('--appointments', type=int)
+    parser.add_argument('--artists', type=int)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests sent to each route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--bulk-rows', type=int, default=20)
+    parser.add_argument('--routes', nargs='*',
+                        help='only run the routes whose rule contains one of these')
+    parser.add_argument('--prefix', default='Bench Routes ')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the seeded rows for the next run')
+    parser.add_argument('--output', help='write the report to this file')
+    parser.add_argument('--baseline', help='report to compare with')
+    args = parser.parse_args()
+
+    clients = args.clients or SCALES[args.scale]
+    appointments = args.appointments or SCALES[args.scale]
+    artists = args.artists or max(10, clients // 100)
+
+    private_key, jwk = make_signing_key()
+    auth.jwks_cache.set_fetcher(lambda: {'keys': [jwk]})
+    token = make_token(private_key, jwk['kid'], auth.AUTH0_DOMAIN,
+                       auth.API_AUDIENCE, PERMISSIONS)
+    headers = {'Authorization': 'Bearer ' + token}
+
+    app = create_app()
+    queries = threading.local()
+    queries.count = 0
+
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        queries.count = getattr(queries, 'count', 0) + 1
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count_query)
+        artist_ids, client_ids, appointment_ids = seed(args.prefix, artists, clients,
+                                                       appointments)
+        db.session.remove()
+
+    state = {'artists': artist_ids, 'clients': client_ids, 'appointments': appointment_ids,
+             'created_artist': [], 'created_client': [], 'created_appointment': []}
+    requests = route_requests(args.prefix, state, args.bulk_rows)
+    covered = {(method, rule) for method, rule, make_request in requests}
+    unbenchmarked = sorted('{} {}'.format(method, rule.rule)
+                           for rule in app.url_map.iter_rules() if rule.endpoint != 'static'
+                           for method in rule.methods - {'HEAD', 'OPTIONS'}
+                           if (method, rule.rule) not in covered)
+
+    routes = {}
+    try:
+        for method, rule, make_request in requests:
+            if args.routes and not any(part in rule for part in args.routes):
+                continue
+            count = args.requests
+            if method == 'DELETE':
+                count = min(count, len(state['created_' + rule.split('/')[2].rstrip('s')]))
+            log('{} {}'.format(method, rule))
+            routes['{} {}'.format(method, rule)] = run_route(
+                app, headers, method, make_request, state, count, args.concurrency, queries)
+    finally:
+        if not args.keep:
+            with app.app_context():
+                clean_up(args.prefix)
+
+    report = {
+              'commit': git_commit(),
+              'scale': {'artists': len(artist_ids), 'clients': len(client_ids),
+                        'appointments': len(appointment_ids)},
+              'requests_per_route': args.requests,
+              'concurrency': args.concurrency,
+              'routes': routes,
+              'unbenchmarked_routes': unbenchmarked
+              }
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            report['changes'] = compare(routes, json.load(baseline_file))
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+'''
+Benchmark for the client search on a large clients table
+
+Seeds synthetic clients with realistic names, emails and phone numbers
+in a transaction which is rolled back afterwards, then times the first
+page of the search query for a mix of names, typos, email and phone
+fragments.
+
+Needs a database with the current schema in DATABASE_URL.
+Run from the backend directory:
+    python -m benchmarks.bench_search --rows 1000000
+'''
+import argparse
+import json
+import time
+
+from app import create_app, SEARCH_PER_PAGE
+from models import db, search, Client
+
+FIRST_NAMES = ('james mary robert patricia john jennifer michael linda david '
+               'elizabeth william barbara richard susan joseph jessica thomas '
+               'sarah charles karen daniel nancy matthew lisa anthony betty '
+               'mark sandra steven ashley paul emily andrew donna joshua kevin '
+               'brian amanda george melissa lamar jalen aaron deshaun patrick '
+               'wei fatima olga diego kwame priya')
+LAST_NAMES = ('smith johnson williams brown jones garcia miller davis '
+              'rodriguez martinez hernandez lopez gonzalez wilson anderson '
+              'thomas taylor moore jackson martin lee perez thompson white '
+              'harris sanchez clark ramirez lewis robinson walker young allen '
+              'king wright scott torres nguyen hill flores green adams nelson '
+              'okafor ivanova patel kim rossi haddad silva chen')
+
+QUERIES = ('john smith', 'jon', 'okafor', 'patrik', 'gonzales', 'priya patel',
+           'wei.chen', 'jennifer', '4321', 'aol')
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        connection = db.engine.connect()
+        queries = {terms: search(Client, terms).limit(SEARCH_PER_PAGE).statement
+                   for terms in QUERIES}
+
+    transaction = connection.begin()
+    try:
+        started = time.perf_counter()
+        connection.execute(
+            "INSERT INTO clients (name, email, phone) "
+            "SELECT initcap(first) || ' ' || initcap(last), "
+            "first || (ARRAY['.', '_', ''])[1 + mod(i, 3)] || last "
+            "|| CASE WHEN mod(i, 5) < 3 THEN mod(i, 997)::text ELSE '' END "
+            "|| '@' || (ARRAY['gmail.com', 'yahoo.com', 'aol.com', 'proton.me'])[1 + mod(i, 4)], "
+            "lpad((100 + floor(random() * 900))::text, 3, '0') || '-' "
+            "|| lpad(floor(random() * 1000)::text, 3, '0') || '-' "
+            "|| lpad(floor(random() * 10000)::text, 4, '0') "
+            "FROM (SELECT i, "
+            "(%(first)s::text[])[1 + floor(random() * cardinality(%(first)s::text[]))::int] AS first, "
+            "(%(last)s::text[])[1 + floor(random() * cardinality(%(last)s::text[]))::int] AS last "
+            "FROM generate_series(1, %(rows)s) AS i) AS names",
+            {'first': FIRST_NAMES.split(), 'last': LAST_NAMES.split(),
+             'rows': args.rows})
+        connection.execute('ANALYZE clients')
+        seeded = time.perf_counter() - started
+
+        results = {}
+        for terms, statement in queries.items():
+            compiled = statement.compile(dialect=connection.dialect)
+            timings = []
+            for _ in range(args.iterations):
+                began = time.perf_counter()
+                connection.execute(str(compiled), compiled.params).fetchall()
+                timings.append((time.perf_counter() - began) * 1000)
+            results[terms] = {
+                              'p50_ms': percentile(timings, 0.5),
+                              'p95_ms': percentile(timings, 0.95)
+                              }
+    finally:
+        transaction.rollback()
+        connection.close()
+
+    print(json.dumps({
+                      'rows': args.rows,
+                      'seed_seconds': seeded,
+                      'queries': results
+                      }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
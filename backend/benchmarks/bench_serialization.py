@@ -0,0 +1,110 @@
+'''
+Benchmark for GET /api/artists on a large artists table
+
+Seeds synthetic artists, then times building the artists response the
+previous way, loading ORM instances and passing their format() to
+jsonify, against the Core rows and JSON encoder the endpoint uses now,
+and times the endpoint itself with the response cache turned off. Both
+bodies are checked to be the same bytes.
+
+Needs a database with the current schema in DATABASE_URL. The artists
+it creates are removed afterwards.
+Run from the backend directory:
+    python -m benchmarks.bench_serialization --artists 10000
+'''
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+os.environ['RESPONSE_CACHE_BACKEND'] = 'off'
+
+from flask import jsonify
+from app import create_app
+from models import db, formatted_rows, table_written, Artist
+from serialization import json_response, orjson
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+# Time fn over iterations and return the p50 and p95 in milliseconds
+def measure(fn, iterations):
+    timings = []
+    for _ in range(iterations):
+        began = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - began) * 1000)
+
+    return {
+            'p50_ms': percentile(timings, 0.5),
+            'p95_ms': percentile(timings, 0.95)
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--artists', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app()
+    prefix = 'Serialization Bench {} '.format(datetime.now().strftime('%H%M%S%f'))
+    with app.app_context():
+        db.session.execute(
+            "INSERT INTO artists (name, phone, styles, email, image_link, instagram_link) "
+            "SELECT :prefix || i, '555-010-' || lpad(i::text, 4, '0'), "
+            "'Traditional, Blackwork', 'artist' || i || '@example.com', "
+            "'https://example.com/' || i || '.jpg', "
+            "'https://instagram.com/artist' || i "
+            "FROM generate_series(1, :artists) AS i",
+            {'prefix': prefix, 'artists': args.artists})
+        db.session.commit()
+        table_written(Artist.__table__.name)
+
+    try:
+        with app.test_request_context('/api/artists'):
+
+            def orm_jsonify():
+                artists = [artist.format() for artist in Artist.query.all()]
+                body = jsonify({'success': True, 'artists': artists,
+                                'total_artists': len(artists)}).get_data()
+                db.session.expunge_all()
+                return body
+
+            def core_rows():
+                artists = formatted_rows(Artist.query, Artist)
+                return json_response({'success': True, 'artists': artists,
+                                      'total_artists': len(artists)}).get_data()
+
+            same_bytes = orm_jsonify() == core_rows()
+            results = {
+                       'orm_format_jsonify': measure(orm_jsonify, args.iterations),
+                       'core_rows_json_response': measure(core_rows, args.iterations)
+                       }
+
+        test_client = app.test_client()
+        response_bytes = len(test_client.get('/api/artists').data)
+        results['get_api_artists'] = measure(lambda: test_client.get('/api/artists'),
+                                             args.iterations)
+    finally:
+        with app.app_context():
+            Artist.query.filter(Artist.name.startswith(prefix)).delete(
+                                                     synchronize_session=False)
+            db.session.commit()
+            table_written(Artist.__table__.name)
+
+    print(json.dumps({
+                      'artists': args.artists,
+                      'encoder': 'orjson' if orjson is not None else 'json',
+                      'response_bytes': response_bytes,
+                      'same_bytes': same_bytes,
+                      'timings': results
+                      }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
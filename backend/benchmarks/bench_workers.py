@@ -0,0 +1,240 @@
+'''
+Load test comparing the gunicorn worker classes
+
+Starts gunicorn with gunicorn.conf.py once per worker class and keeps
+--connections concurrent keep-alive connections busy for --duration
+seconds on a mix of public and authorized endpoints, then reports the
+requests per second and latency percentiles of each run.
+
+Tokens are signed with a local key whose JWKS is served by a local HTTP
+server that answers after --jwks-delay seconds, with a short
+JWKS_CACHE_TTL, so the key set is refetched during the run the way a
+slow Auth0 response would be. With --db-latency-ms the app connects to
+Postgres through a local proxy which delays every reply, as a database
+on another host would.
+
+Needs a database with the current schema in DATABASE_URL and the
+gevent and psycogreen packages. Run from the backend directory:
+    python -m benchmarks.bench_workers --connections 200 --duration 20
+'''
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.keys import make_signing_key, make_token
+
+DOMAIN = 'tattoo-api.test'
+AUDIENCE = 'https://tattoo-api'
+PATHS = (
+         ('/api/artists', False),
+         ('/api/artists/available?at=Mon,%2006%20Jan%202031%2010:00:00%20GMT', False),
+         ('/api/clients', True),
+         ('/api/clients/search?q=smith', True),
+         ('/api/appointments?expand=artist,client', True)
+         )
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+# Serve the JWKS document after delay seconds
+def serve_jwks(jwks, delay):
+    body = json.dumps(jwks).encode('utf-8')
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Forward connections to host:port, delaying each chunk sent back by
+# latency seconds
+def serve_latency_proxy(host, port, latency):
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+
+    def pipe(source, target, delay):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                if delay:
+                    time.sleep(delay)
+                target.sendall(data)
+        except OSError:
+            pass
+        finally:
+            target.close()
+
+    def accept():
+        while True:
+            client, _ = listener.accept()
+            server = socket.create_connection((host, port))
+            for source, target, delay in ((client, server, 0), (server, client, latency)):
+                threading.Thread(target=pipe, args=(source, target, delay),
+                                 daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn did not start')
+
+
+# Send a GET on an open connection and read the response. Returns the
+# status and whether the server keeps the connection open
+async def get(reader, writer, path, token):
+    request = 'GET {} HTTP/1.1\r\nHost: localhost\r\n'.format(path)
+    if token is not None:
+        request += 'Authorization: Bearer {}\r\n'.format(token)
+    writer.write((request + '\r\n').encode('ascii'))
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    await reader.readexactly(int(headers.get('content-length', 0)))
+    return int(status_line.split()[1]), headers.get('connection', '').lower() != 'close'
+
+
+async def drive(port, token, connections, duration):
+    latencies = []
+    statuses = {}
+    deadline = time.monotonic() + duration
+
+    async def client(offset):
+        reader = writer = None
+        i = offset
+        while time.monotonic() < deadline:
+            path, authorized = PATHS[i % len(PATHS)]
+            i += 1
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            began = time.perf_counter()
+            try:
+                status, keep_alive = await get(reader, writer, path,
+                                               token if authorized else None)
+            except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                status, keep_alive = 'error', False
+            latencies.append((time.perf_counter() - began) * 1000)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if not keep_alive:
+                writer.close()
+                writer = None
+        if writer is not None:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(connections)))
+    elapsed = time.perf_counter() - started
+
+    return {
+            'requests': len(latencies),
+            'statuses': statuses,
+            'requests_per_second': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 0.5),
+            'p99_ms': percentile(latencies, 0.99)
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--worker-classes', nargs='+', default=['sync', 'gevent'])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--connections', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--jwks-delay', type=float, default=1.0)
+    parser.add_argument('--db-latency-ms', type=float, default=0)
+    parser.add_argument('--port', type=int, default=8123)
+    args = parser.parse_args()
+
+    private_key, jwk = make_signing_key()
+    jwks_server = serve_jwks({'keys': [jwk]}, args.jwks_delay)
+    token = make_token(private_key, jwk['kid'], DOMAIN, AUDIENCE, ['get:all'])
+
+    database_url = os.environ['DATABASE_URL']
+    if args.db_latency_ms:
+        url = urlsplit(database_url)
+        proxy_port = serve_latency_proxy(url.hostname, url.port or 5432,
+                                         args.db_latency_ms / 1000)
+        netloc = url.netloc.rsplit('@', 1)
+        netloc[-1] = '127.0.0.1:{}'.format(proxy_port)
+        database_url = urlunsplit(url._replace(netloc='@'.join(netloc)))
+
+    env = dict(os.environ,
+               DATABASE_URL=database_url,
+               PORT=str(args.port),
+               WEB_CONCURRENCY=str(args.workers),
+               AUTH0_DOMAIN=DOMAIN,
+               ALGORITHMS='RS256',
+               API_AUDIENCE=AUDIENCE,
+               JWKS_URL='http://127.0.0.1:{}/jwks.json'.format(jwks_server.server_port),
+               JWKS_CACHE_TTL='2',
+               JWKS_REFRESH_INTERVAL='1',
+               RESPONSE_CACHE_BACKEND='off')
+
+    results = {}
+    for worker_class in args.worker_classes:
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                                   '--log-level', 'warning', 'app:APP'],
+                                  env=dict(env, GUNICORN_WORKER_CLASS=worker_class))
+        try:
+            wait_for_port(args.port)
+            results[worker_class] = asyncio.run(drive(args.port, token,
+                                                      args.connections, args.duration))
+        finally:
+            server.terminate()
+            server.wait()
+
+    jwks_server.shutdown()
+    print(json.dumps({
+                      'workers': args.workers,
+                      'connections': args.connections,
+                      'duration_seconds': args.duration,
+                      'jwks_delay_seconds': args.jwks_delay,
+                      'db_latency_ms': args.db_latency_ms,
+                      'results': results
+                      }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import time
+
+from Crypto.PublicKey import RSA
+from jose import jwt
+from jose.utils import long_to_base64
+
+
+# Build a local RSA signing key and the matching JWK
+def make_signing_key(kid='bench-key'):
+    key = RSA.generate(2048)
+    jwk = {
+        'kty': 'RSA',
+        'kid': kid,
+        'use': 'sig',
+        'alg': 'RS256',
+        'n': long_to_base64(key.n).decode('ascii'),
+        'e': long_to_base64(key.e).decode('ascii')
+    }
+    return key.export_key('PEM').decode('ascii'), jwk
+
+
+# Sign a token with the claims verify_decode_jwt expects
+def make_token(private_key, kid, domain, audience, permissions,
+               expires_in=3600):
+    claims = {
+        'iss': 'https://' + domain + '/',
+        'aud': audience,
+        'exp': int(time.time()) + expires_in,
+        'permissions': permissions
+    }
+    return jwt.encode(claims, private_key, algorithm='RS256',
+                      headers={'kid': kid})
@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+
+# Counter cache settings
+COUNTER_CACHE_TTL = float(os.environ.get('COUNTER_CACHE_TTL', 5))
+APPROXIMATE_COUNTS = os.environ.get('APPROXIMATE_COUNTS', '').lower() in ('1', 'true', 'yes')
+APPROXIMATE_COUNT_THRESHOLD = int(os.environ.get('APPROXIMATE_COUNT_THRESHOLD', 100000))
+
+'''
+Counter cache
+Totals such as total_artists are computed with COUNT queries, kept in
+process for COUNTER_CACHE_TTL seconds and dropped as soon as a write to
+one of the tables they count goes through the model methods.
+Other worker processes pick up the change when their TTL runs out.
+'''
+
+
+class Counter:
+    def __init__(self, name, count, tables, estimate=None):
+        self.name = name
+        self.count = count
+        self.tables = tables
+        self.estimate = estimate
+        self.value = None
+        self.expires_at = 0
+        self.generation = 0
+
+
+class CounterCache:
+    def __init__(self, ttl=COUNTER_CACHE_TTL, approximate=APPROXIMATE_COUNTS,
+                 threshold=APPROXIMATE_COUNT_THRESHOLD, clock=time.monotonic):
+        self.ttl = ttl
+        self.approximate = approximate
+        self.threshold = threshold
+        self.clock = clock
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    # Register a counter computed by count(), which depends on tables.
+    # estimate() may return a cheap row estimate used in approximate mode
+    def register(self, name, count, tables, estimate=None):
+        self._counters[name] = Counter(name, count, tuple(tables), estimate)
+
+    def _compute(self, counter):
+        if self.approximate and counter.estimate is not None:
+            estimate = counter.estimate()
+            # Small or never analyzed tables are counted exactly
+            if estimate is not None and estimate >= self.threshold:
+                return int(estimate)
+
+        return counter.count()
+
+    def get(self, name):
+        counter = self._counters[name]
+        with self._lock:
+            if counter.value is not None and self.clock() < counter.expires_at:
+                return counter.value
+            generation = counter.generation
+
+        value = self._compute(counter)
+
+        with self._lock:
+            # Only keep the value if no write happened while counting
+            if counter.generation == generation:
+                counter.value = value
+                counter.expires_at = self.clock() + self.ttl
+
+        return value
+
+    # Drop every counter which depends on table
+    def invalidate(self, table):
+        with self._lock:
+            for counter in self._counters.values():
+                if table in counter.tables:
+                    counter.value = None
+                    counter.generation += 1
+
+    def clear(self):
+        with self._lock:
+            for counter in self._counters.values():
+                counter.value = None
+                counter.generation += 1
+
+
+counter_cache = CounterCache()
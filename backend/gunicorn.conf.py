@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+
+'''
+Gunicorn settings, read from the environment
+The default sync worker serves one request at a time per process.
+GUNICORN_WORKER_CLASS=gevent serves up to GUNICORN_WORKER_CONNECTIONS
+requests per process, each in a greenlet: gevent makes the standard
+library sockets cooperative and psycogreen does the same for psycopg2,
+so a request waiting on Postgres or on Auth0 lets the others run
+'''
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '8000')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+# Heroku sets WEB_CONCURRENCY from the dyno size
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Threads per sync worker, which then uses the gthread worker
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# The workers write their metrics to files in this directory, which the
+# worker answering /metrics sums. It is read when the app is imported,
+# after the workers are forked
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                      os.path.join(tempfile.gettempdir(), 'tattoo-shop-metrics'))
+
+
+# Drop the metrics of a previous run
+def on_starting(server):
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+# Leave the pool gauges of a stopped worker out of the sums. Its
+# counters and histograms are kept
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,54 @@
+import os
+import threading
+import time
+
+# Seconds the results of the readiness probes are reused, so frequent
+# load balancer checks do not each query the database
+HEALTH_CACHE_TTL = float(os.environ.get('HEALTH_CACHE_TTL', 5))
+
+'''
+Health checks
+Liveness only says the worker answers requests. Readiness runs a probe
+per dependency the requests need, the database and the Auth0 signing
+keys, and fails when any of them fails so the load balancer sends no
+traffic to the worker. The results, with the latency of each probe, are
+cached for HEALTH_CACHE_TTL seconds and a single request runs the probes
+when they expire while the others wait for its results.
+'''
+
+
+# Runs named probes. A probe returns a dict of details to report, or
+# None, and raises when the dependency is unavailable
+class HealthChecks:
+    def __init__(self, probes, ttl=HEALTH_CACHE_TTL, clock=time.monotonic):
+        self.probes = probes
+        self.ttl = ttl
+        self.clock = clock
+        self._results = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def run_probe(self, probe):
+        started = time.perf_counter()
+        try:
+            details = probe() or {}
+            result = {'ok': True}
+            result.update(details)
+        except Exception as error:
+            # The error type only, messages may hold connection strings
+            result = {'ok': False, 'error': type(error).__name__}
+        result['latency_ms'] = (time.perf_counter() - started) * 1000
+        return result
+
+    # Return whether every probe passed, the result of each probe and the
+    # age of the results in seconds
+    def check(self):
+        with self._lock:
+            now = self.clock()
+            if self._checked_at is None or now - self._checked_at >= self.ttl:
+                self._results = {name: self.run_probe(probe)
+                                 for name, probe in self.probes.items()}
+                self._checked_at = now = self.clock()
+
+            ready = all(result['ok'] for result in self._results.values())
+            return ready, self._results, now - self._checked_at
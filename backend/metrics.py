@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import request
+from query_stats import current_stats
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+# Directory the worker processes write their metrics to, set by
+# gunicorn.conf.py. Without it the metrics of the current process are
+# served
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+# Seconds, token verification is usually well under a millisecond
+AUTH_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+# Route label of requests which match no route, so unknown URLs do not
+# create new series
+UNMATCHED_ROUTE = 'unmatched'
+
+'''
+Metrics
+Request counts, latency, database time, token verification time and
+verified token cache lookups in the Prometheus text format, served by GET /metrics. Under gunicorn every
+worker writes its metrics to files in PROMETHEUS_MULTIPROC_DIR and the
+worker answering the scrape sums the files of all workers, so counters
+and histograms cover the whole server whichever worker answers. The
+connection pool gauges are summed over the live workers.
+The prometheus_client package is optional: without it nothing is
+recorded and /metrics answers 404.
+'''
+
+if prometheus_client is not None:
+    REQUESTS = prometheus_client.Counter(
+        'http_requests_total', 'Requests handled',
+        ['method', 'route', 'status'])
+    REQUEST_SECONDS = prometheus_client.Histogram(
+        'http_request_duration_seconds', 'Time to handle a request',
+        ['method', 'route'])
+    DB_SECONDS = prometheus_client.Histogram(
+        'http_request_db_seconds', 'Time spent running SQL statements per request',
+        ['method', 'route'])
+    DB_QUERIES = prometheus_client.Histogram(
+        'http_request_db_queries', 'SQL statements run per request',
+        ['method', 'route'], buckets=QUERY_BUCKETS)
+    AUTH_SECONDS = prometheus_client.Histogram(
+        'auth_duration_seconds',
+        'Time spent in requires_auth, and fetching keys and decoding tokens within it',
+        ['step'], buckets=AUTH_BUCKETS)
+    TOKEN_CACHE_HITS = prometheus_client.Counter(
+        'auth_token_cache_hits_total', 'Tokens found in the verified token cache')
+    TOKEN_CACHE_MISSES = prometheus_client.Counter(
+        'auth_token_cache_misses_total', 'Tokens not found in the verified token cache')
+    POOL_CONNECTIONS = prometheus_client.Gauge(
+        'db_pool_connections', 'Database connections of the pools by state',
+        ['state'], multiprocess_mode='livesum')
+    POOL_CHECKOUTS = prometheus_client.Counter(
+        'db_pool_checkouts_total', 'Connections checked out of the pools')
+    POOL_TIMEOUTS = prometheus_client.Counter(
+        'db_pool_timeouts_total', 'Checkouts which timed out waiting for a connection')
+
+
+# Time the block as one step of token verification
+@contextmanager
+def auth_timer(step):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if prometheus_client is not None:
+            AUTH_SECONDS.labels(step).observe(time.perf_counter() - started)
+
+
+# Count a lookup in the verified token cache
+def count_token_cache(hit):
+    if prometheus_client is not None:
+        (TOKEN_CACHE_HITS if hit else TOKEN_CACHE_MISSES).inc()
+
+
+# Copies the stats of the connection pool of this process to the metrics.
+# The pool counts checkouts and timeouts itself, so the counters are
+# increased by the change since the last copy
+class PoolMetrics:
+    def __init__(self, pool_stats):
+        self.pool_stats = pool_stats
+        self._checkouts = 0
+        self._timeouts = 0
+        self._lock = threading.Lock()
+
+    def update(self):
+        stats = self.pool_stats()
+        with self._lock:
+            POOL_CONNECTIONS.labels('in_use').set(stats['in_use'])
+            POOL_CONNECTIONS.labels('idle').set(stats.get('idle') or 0)
+            POOL_CHECKOUTS.inc(max(0, stats['checkouts'] - self._checkouts))
+            POOL_TIMEOUTS.inc(max(0, stats['timeouts'] - self._timeouts))
+            self._checkouts = stats['checkouts']
+            self._timeouts = stats['timeouts']
+
+
+# Record the requests of app, with the statements counted by query_stats.
+# pool_stats returns the stats of the connection pool, see
+# pool.CheckoutTiming.stats
+def setup_metrics(app, pool_stats):
+    if prometheus_client is None:
+        return
+
+    pool_metrics = PoolMetrics(pool_stats)
+
+    @app.after_request
+    def record_request(response):
+        route = request.url_rule.rule if request.url_rule is not None else UNMATCHED_ROUTE
+        REQUESTS.labels(request.method, route, response.status_code).inc()
+
+        stats = current_stats()
+        if stats is not None:
+            REQUEST_SECONDS.labels(request.method, route).observe(
+                                                  time.perf_counter() - stats.started)
+            DB_SECONDS.labels(request.method, route).observe(stats.seconds)
+            DB_QUERIES.labels(request.method, route).observe(stats.queries)
+
+        pool_metrics.update()
+        return response
+
+
+# Return the body and content type of a scrape, or None when
+# prometheus_client is not installed
+def render_metrics():
+    if prometheus_client is None:
+        return None
+
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=PROMETHEUS_MULTIPROC_DIR)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
@@ -1,9 +1,16 @@
 import os
 from sqlalchemy import Column, String, Integer, create_engine
+from sqlalchemy.dialects.postgresql import ExcludeConstraint, insert
+from sqlalchemy.ext.hybrid import hybrid_property
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
+import re
+from counters import counter_cache
+from versions import table_versions
+from pool import engine_options
+from query_stats import query_stats
 
 database_path = os.environ.get('DATABASE_URL')
 
@@ -11,18 +18,110 @@ if not database_path:
     database_name = "tattoo_shop"
     database_path = f"postgres://localhost:5432/{database_name}"
 
-db = SQLAlchemy()
+# Objects are not expired on commit, so a newly inserted row can be
+# read back from the id and server defaults returned by the INSERT
+# instead of being reloaded. The session is removed after each request
+db = SQLAlchemy(session_options={'expire_on_commit': False})
 
-def setup_db(app, database_path=database_path):
+# Default length of an appointment in minutes. It is also the server
+# default of the duration column set by migration b3e1c9a4d2f7, so rows
+# inserted with SQL get the same length, and is not configurable
+APPOINTMENT_MINUTES = 60
+# Longest appointment which can be booked, also bounds overlap lookups
+MAX_APPOINTMENT_MINUTES = int(os.environ.get('MAX_APPOINTMENT_MINUTES', 8 * 60))
+
+# Postgres error code raised when a row violates an exclusion constraint
+EXCLUSION_VIOLATION = '23P01'
+
+# Operator class of the search indexes. A larger signature than the
+# default 12 bytes keeps the GiST index selective for documents holding
+# a name, email and phone number
+SEARCH_INDEX_OPS = 'gist_trgm_ops(siglen=256)'
+
+
+# Drop the cached totals and bump the version of a table after a write
+def table_written(table):
+    counter_cache.invalidate(table)
+    table_versions.bump(table)
+
+
+# Configure the database of app. The connection pool is configured by
+# the DB_POOL_* and PGBOUNCER environment variables unless
+# pool_options, see pool.engine_options, are given. The statements of
+# each request are counted and timed, see query_stats
+def setup_db(app, database_path=database_path, pool_options=None):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = (engine_options() if pool_options is None
+                                               else pool_options)
     db.app = app
     db.init_app(app)
+    query_stats.init_app(app)
     migrate = Migrate(app, db)
 
 
+'''
+Styles
+Artist.styles keeps the styles as entered, which format() returns. The
+model methods also link each artist to one row per style in the styles
+table, which the style filter joins through
+'''
+# Styles are separated by commas, semicolons or slashes
+STYLE_SEPARATORS = re.compile(r'[,;/]')
+
+artist_styles = db.Table('artist_styles',
+                         db.Column('artist_id', db.Integer,
+                                   db.ForeignKey('artists.id', ondelete='CASCADE'),
+                                   primary_key=True),
+                         db.Column('style_id', db.Integer,
+                                   db.ForeignKey('styles.id', ondelete='CASCADE'),
+                                   primary_key=True),
+                         # Artists by style, the primary key serves styles by artist
+                         db.Index('ix_artist_styles_style_id_artist_id',
+                                  'style_id', 'artist_id')
+                         )
+
+
+# Compare styles case and whitespace insensitively
+def normalize_style(style):
+    return ' '.join(style.split()).lower()
+
+
+# Split the styles text of an artist into normalized style names
+def split_styles(styles):
+    names = []
+    for style in STYLE_SEPARATORS.split(styles or ''):
+        name = normalize_style(style)
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+class Style(db.Model):
+    __tablename__ = 'styles'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+    # Return the styles with the given normalized names, creating the
+    # missing ones. Concurrent writers creating the same style are
+    # resolved by the unique name, in sorted order to avoid deadlocks
+    @classmethod
+    def named(cls, names):
+        if not names:
+            return []
+
+        db.session.execute(
+            insert(cls.__table__).values(
+                [{'name': name} for name in sorted(names)]
+            ).on_conflict_do_nothing(index_elements=['name'])
+        )
+        return cls.query.filter(cls.name.in_(names)).all()
+
+
 class Artist(db.Model):
     __tablename__ = 'artists'
+    __mapper_args__ = {'eager_defaults': True}
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(60), nullable=False, unique=True)
@@ -33,8 +132,11 @@ class Artist(db.Model):
     email = db.Column(db.String(300))
     # One to Many relationship with appointments
     appointments = db.relationship('Appointment', backref='artist_appt_id',
-                                   lazy=True
+                                   lazy=True, passive_deletes=True
                                    )
+    # Many to Many relationship with the normalized styles
+    style_list = db.relationship('Style', secondary=artist_styles, lazy=True,
+                                 passive_deletes=True)
 
     def __init__(self, name, phone='', styles='', image_link='', instagram_link='', email=''):
         self.name = name
@@ -45,30 +147,54 @@ class Artist(db.Model):
         self.email = email
 
     def insert(self):
+        self.style_list = Style.named(split_styles(self.styles))
         db.session.add(self)
         db.session.commit()
+        table_written(self.__table__.name)
 
     def update(self):
+        if db.inspect(self).attrs.styles.history.has_changes():
+            self.style_list = Style.named(split_styles(self.styles))
         db.session.commit()
+        table_written(self.__table__.name)
+
+    # Link bulk inserted artists to their styles, in the same transaction
+    @classmethod
+    def bulk_insert_related(cls, ids, rows):
+        names = {id: split_styles(row.get('styles')) for id, row in zip(ids, rows)}
+        styles = {style.name: style.id for style in
+                  Style.named({name for row_names in names.values()
+                               for name in row_names})}
+        links = [{'artist_id': id, 'style_id': styles[name]}
+                 for id, row_names in names.items() for name in row_names]
+        if links:
+            db.session.execute(artist_styles.insert().values(links))
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        table_written(self.__table__.name)
+
+    # Text matched by the artist search. The query and the trigram index
+    # are built from this expression so the planner can use the index
+    @classmethod
+    def search_document(cls):
+        return db.func.lower(cls.name + ' '
+                             + db.func.coalesce(cls.email, '') + ' '
+                             + db.func.coalesce(cls.phone, '') + ' '
+                             + db.func.coalesce(cls.styles, ''))
+
+    # Columns returned by format(), also read by formatted_rows
+    format_columns = ('id', 'name', 'phone', 'styles', 'email', 'image_link',
+                      'instagram_link')
 
     def format(self):
-        return {
-                'id': self.id,
-                'name': self.name,
-                'phone': self.phone,
-                'styles': self.styles,
-                'email': self.email,
-                'image_link': self.image_link,
-                'instagram_link': self.instagram_link
-                }
+        return {name: getattr(self, name) for name in self.format_columns}
 
 
 class Client(db.Model):
     __tablename__ = 'clients'
+    __mapper_args__ = {'eager_defaults': True}
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(60), nullable=False)
@@ -77,7 +203,7 @@ class Client(db.Model):
     address = db.Column(db.String(240))
     # One To Many relationship with appointments
     appointments = db.relationship('Appointment', backref='client_appt_id',
-                                   lazy=True
+                                   lazy=True, passive_deletes=True
                                    )
 
     def __init__(self, name, phone='', email='', address=''):
@@ -89,48 +215,303 @@ class Client(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        table_written(self.__table__.name)
 
     def update(self):
         db.session.commit()
+        table_written(self.__table__.name)
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        table_written(self.__table__.name)
+
+    # Text matched by the client search, see Artist.search_document
+    @classmethod
+    def search_document(cls):
+        return db.func.lower(cls.name + ' '
+                             + db.func.coalesce(cls.email, '') + ' '
+                             + db.func.coalesce(cls.phone, ''))
+
+    # Columns returned by format(), also read by formatted_rows
+    format_columns = ('id', 'name', 'email', 'phone', 'address')
 
     def format(self):
-        return {
-                'id': self.id,
-                'name': self.name,
-                'email': self.email,
-                'phone': self.phone,
-                'address': self.address
-                }
+        return {name: getattr(self, name) for name in self.format_columns}
 
 
 class Appointment(db.Model):
+    __mapper_args__ = {'eager_defaults': True}
+    # Lookups by artist or client within a date range, and by date alone
+    # for upcoming appointments
+    __table_args__ = (
+                      db.Index('ix_appointment_artist_appointment_date',
+                               'artist', 'appointment_date'),
+                      db.Index('ix_appointment_client_appointment_date',
+                               'client', 'appointment_date'),
+                      db.Index('ix_appointment_appointment_date',
+                               'appointment_date'),
+                      # An artist can not be booked twice at the same time.
+                      # The artist is compared as a single value range so
+                      # the gist index does not need the btree_gist extension
+                      ExcludeConstraint(
+                          (db.text("int4range(artist, artist, '[]')"), '='),
+                          (db.text("tsrange(appointment_date, appointment_date"
+                                   " + duration * interval '1 minute')"), '&&'),
+                          name='appointment_artist_no_overlap',
+                          using='gist',
+                          where=db.text('artist IS NOT NULL')
+                          ),
+                      )
 
     id = db.Column(db.Integer, primary_key=True)
-    client = db.Column(db.Integer, db.ForeignKey("clients.id"))
-    artist = db.Column(db.Integer, db.ForeignKey("artists.id"))
+    # Deleting an artist or client leaves its appointments to the
+    # database, which nulls them, so the delete loads no appointments
+    client = db.Column(db.Integer, db.ForeignKey("clients.id", onupdate='CASCADE',
+                                                 ondelete='SET NULL'))
+    artist = db.Column(db.Integer, db.ForeignKey("artists.id", onupdate='CASCADE',
+                                                 ondelete='SET NULL'))
     appointment_date = db.Column(db.DateTime, nullable=False)
+    # Length of the appointment in minutes
+    duration = db.Column(db.Integer, nullable=False,
+                         default=APPOINTMENT_MINUTES,
+                         server_default=str(APPOINTMENT_MINUTES))
 
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        table_written(self.__table__.name)
 
     def update(self):
         db.session.commit()
+        table_written(self.__table__.name)
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        table_written(self.__table__.name)
 
-    def format(self):
-        artist = Artist.query.filter(Artist.id == self.artist).one_or_none()
-        client = Client.query.filter(Client.id == self.client).one_or_none()
-        return {
-                'id': self.id,
-                'artist': artist.id,
-                'client': client.id,
-                'appointment_date': self.appointment_date
-                }
+    # Filter for appointments which overlap the interval [start, end).
+    # No appointment is longer than MAX_APPOINTMENT_MINUTES, which keeps
+    # both bounds on the indexed appointment_date column
+    @classmethod
+    def overlapping(cls, start, end):
+        return db.and_(
+                       cls.appointment_date < end,
+                       cls.appointment_date > start - timedelta(minutes=MAX_APPOINTMENT_MINUTES),
+                       cls.end_date > start
+                       )
+
+    @hybrid_property
+    def end_date(self):
+        return self.appointment_date + timedelta(minutes=self.duration)
+
+    @end_date.expression
+    def end_date(cls):
+        return cls.appointment_date + cls.duration * db.text("interval '1 minute'")
+
+    # Return the first appointment of artist overlapping [start, end),
+    # leaving out the appointment being updated
+    @classmethod
+    def find_conflict(cls, artist, start, end, exclude_id=None):
+        query = cls.query.filter(cls.artist == artist, cls.overlapping(start, end))
+        if exclude_id is not None:
+            query = query.filter(cls.id != exclude_id)
+        return query.order_by(cls.appointment_date).first()
+
+    # Relationships which can be embedded with format(expand=...)
+    expandable = {
+                  'artist': 'artist_appt_id',
+                  'client': 'client_appt_id'
+                  }
+
+    # Query appointments with the expanded relationships loaded in the
+    # same round trip
+    @classmethod
+    def query_expanded(cls, expand=()):
+        query = cls.query
+        for name in expand:
+            query = query.options(
+                db.joinedload(getattr(cls, cls.expandable[name]))
+            )
+        return query
+
+    # Columns returned by format(), also read by formatted_rows
+    format_columns = ('id', 'artist', 'client', 'appointment_date', 'duration')
+
+    # Artist and client are read from the foreign key columns unless
+    # expanded, in which case the related object is embedded
+    def format(self, expand=()):
+        formatted = {name: getattr(self, name) for name in self.format_columns}
+        for name in expand:
+            related = getattr(self, self.expandable[name])
+            formatted[name] = related.format() if related else None
+
+        return formatted
+
+
+# Checkout latency and connection counts of the connection pool
+def pool_stats():
+    return db.engine.pool.stats()
+
+
+# Readiness probe of the database: checks a connection out of the pool,
+# which pings it when DB_POOL_PRE_PING is set, and runs SELECT 1
+def ping_database():
+    with db.engine.connect() as connection:
+        connection.execute('SELECT 1').scalar()
+
+
+'''
+Formatted rows
+List endpoints read the format() of many rows at once. The columns are
+selected from the ORM query and read as Core rows, so no instances are
+built or added to the identity map
+'''
+
+
+# Return the format() of every row of query, a query of model. The
+# relationships named in expand are embedded as in Appointment.format
+def formatted_rows(query, model, expand=()):
+    columns = [getattr(model, name) for name in model.format_columns]
+    embedded = []
+    for name in expand:
+        relationship = getattr(model, model.expandable[name])
+        related = relationship.property.mapper.class_
+        # The joined relationships are many to one, so joining them after
+        # a LIMIT does not change the rows returned
+        query = query.enable_assertions(False).outerjoin(relationship)
+        columns += [getattr(related, column).label(name + '_' + column)
+                    for column in related.format_columns]
+        embedded.append((name, related))
+
+    result = db.session.execute(query.with_entities(*columns).statement)
+
+    rows = []
+    for row in result:
+        formatted = {name: row[name] for name in model.format_columns}
+        for name, related in embedded:
+            if row[name + '_id'] is None:
+                formatted[name] = None
+            else:
+                formatted[name] = {column: row[name + '_' + column]
+                                   for column in related.format_columns}
+        rows.append(formatted)
+
+    return rows
+
+
+# Yield the format() of the rows of model with an id above after, in id
+# order, in lists of batch_size rows. The rows are read through a server
+# side cursor, so only one batch is held in memory whatever the table size
+def iter_formatted(model, after=0, batch_size=1000):
+    table = model.__table__
+    columns = [table.c[name] for name in model.format_columns]
+    statement = db.select(columns).where(table.c.id > after).order_by(table.c.id)
+
+    connection = db.engine.connect()
+    try:
+        result = connection.execution_options(stream_results=True).execute(statement)
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [dict(row) for row in rows]
+    finally:
+        connection.close()
+
+
+'''
+Search
+Trigram indexes over the search documents of artists and clients.
+pg_trgm is created by migration
+'''
+db.Index('ix_artists_search', Artist.search_document().label('search'),
+         postgresql_using='gist', postgresql_ops={'search': SEARCH_INDEX_OPS})
+db.Index('ix_clients_search', Client.search_document().label('search'),
+         postgresql_using='gist', postgresql_ops={'search': SEARCH_INDEX_OPS})
+
+
+# Query rows of model whose search document contains a word similar to
+# terms, closest first. Ordering by the <->> distance lets the GiST
+# index return the best matches first instead of ranking every match.
+# The % of the <% operator is doubled for the psycopg2 paramstyle
+def search(model, terms):
+    terms = terms.lower()
+    document = model.search_document()
+    return model.query.filter(
+                              db.literal(terms).op('<%%')(document)
+                              ).order_by(document.op('<->>')(terms))
+
+
+# Filter for artists with style among their styles, looked up through
+# the unique style name and the artists by style index
+def has_style(style):
+    return Artist.id.in_(
+        db.select([artist_styles.c.artist_id]).select_from(
+            artist_styles.join(Style.__table__)
+        ).where(Style.name == normalize_style(style))
+    )
+
+
+'''
+Bulk writes
+'''
+
+
+# Insert rows in one INSERT ... VALUES ... RETURNING statement and
+# transaction. Returns the new ids in the order of rows
+def bulk_insert(model, rows):
+    table = model.__table__
+    result = db.session.execute(
+        table.insert().values(rows).returning(table.c.id)
+    )
+    ids = [row[0] for row in result]
+    if hasattr(model, 'bulk_insert_related'):
+        model.bulk_insert_related(ids, rows)
+    db.session.commit()
+    table_written(table.name)
+    return ids
+
+
+# True when a commit failed because an appointment overlaps another
+# booking of the same artist
+def is_booking_conflict(error):
+    return getattr(getattr(error, 'orig', None), 'pgcode', None) == EXCLUSION_VIOLATION
+
+
+'''
+Totals returned by the API, cached in counter_cache
+'''
+
+
+def count_rows(model):
+    return db.session.query(db.func.count(model.id)).scalar()
+
+
+# Planner estimate of the table size, None if the table was never analyzed
+def estimate_rows(model):
+    estimate = db.session.execute(
+        'SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)',
+        {'table': model.__table__.name}
+    ).scalar()
+    if estimate is None or estimate < 0:
+        return None
+    return estimate
+
+
+def count_upcoming_appointments():
+    return db.session.query(db.func.count(Appointment.id)).filter(
+        Appointment.appointment_date > datetime.now()
+    ).scalar()
+
+
+counter_cache.register('total_artists', lambda: count_rows(Artist),
+                       tables=[Artist.__table__.name],
+                       estimate=lambda: estimate_rows(Artist))
+counter_cache.register('total_clients', lambda: count_rows(Client),
+                       tables=[Client.__table__.name],
+                       estimate=lambda: estimate_rows(Client))
+counter_cache.register('total_upcoming_appointments',
+                       count_upcoming_appointments,
+                       tables=[Appointment.__table__.name])
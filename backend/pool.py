@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+# Connection pool of each worker process. Connections beyond
+# DB_POOL_SIZE, up to DB_MAX_OVERFLOW more, are closed when returned
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+# Seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+# Seconds after which a connection is replaced, before the server or a
+# proxy drops it as idle
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+# Test each connection with a round trip when it is checked out
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+# Connect through PgBouncer in transaction pooling mode
+PGBOUNCER = os.environ.get('PGBOUNCER', '').lower() in ('1', 'true', 'yes')
+
+'''
+Connection pool
+The pools record how long requests wait to check out a connection and
+how many connections are in use, reported by the pool stats endpoint.
+Behind PgBouncer the app keeps no connections of its own: each checkout
+opens a connection to PgBouncer, which pools the server connections.
+psycopg2 never uses server side prepared statements and the app sets no
+session state, so every statement works with transaction pooling
+'''
+
+
+# Records checkouts on a SQLAlchemy pool class
+class CheckoutTiming:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.in_use = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.checkout_seconds = 0.0
+        self.max_checkout_seconds = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.checkout_seconds += waited
+            self.max_checkout_seconds = max(self.max_checkout_seconds, waited)
+
+        return connection
+
+    def _do_return_conn(self, conn):
+        with self._stats_lock:
+            self.in_use -= 1
+        super()._do_return_conn(conn)
+
+    def overflow(self):
+        return None
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                    'pool': type(self).__name__,
+                    'in_use': self.in_use,
+                    'overflow': self.overflow(),
+                    'checkouts': self.checkouts,
+                    'timeouts': self.timeouts,
+                    'average_checkout_ms': (self.checkout_seconds / self.checkouts * 1000
+                                            if self.checkouts else None),
+                    'max_checkout_ms': self.max_checkout_seconds * 1000
+                    }
+
+
+class TimedQueuePool(CheckoutTiming, QueuePool):
+    # Connections open beyond the pool size, negative while the pool
+    # has not opened pool size connections yet
+    def overflow(self):
+        return QueuePool.overflow(self)
+
+    def stats(self):
+        stats = super().stats()
+        stats['size'] = self.size()
+        stats['idle'] = self.checkedin()
+        return stats
+
+
+class TimedNullPool(CheckoutTiming, NullPool):
+    pass
+
+
+# Options of the engine created by Flask-SQLAlchemy
+def engine_options(pgbouncer=PGBOUNCER, size=DB_POOL_SIZE,
+                   max_overflow=DB_MAX_OVERFLOW, timeout=DB_POOL_TIMEOUT,
+                   recycle=DB_POOL_RECYCLE, pre_ping=DB_POOL_PRE_PING):
+    if pgbouncer:
+        return {
+                'poolclass': TimedNullPool,
+                'pool_pre_ping': pre_ping
+                }
+
+    return {
+            'poolclass': TimedQueuePool,
+            'pool_size': size,
+            'max_overflow': max_overflow,
+            'pool_timeout': timeout,
+            'pool_recycle': recycle,
+            'pool_pre_ping': pre_ping
+            }
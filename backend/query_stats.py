@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Statements taking at least this many milliseconds are logged with
+# their redacted parameters
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+# Send the query count and database time of each request in a
+# Server-Timing header
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'true').lower() in ('1', 'true', 'yes')
+# Characters of a statement kept in the logs
+MAX_STATEMENT_LENGTH = 2000
+# Rows of an executemany kept in the logs
+MAX_LOGGED_ROWS = 5
+# Lowest level of the lines logged, INFO logs every request
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+logger = logging.getLogger(__name__)
+# Nothing else configures logging, so the lines are written to stderr,
+# which gunicorn and Heroku collect, by a handler of their own
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(message)s'))
+
+'''
+Query statistics
+Every statement run by an engine while a request is handled is counted
+and timed. After the request the count, the total database time and the
+slowest statement are sent in a Server-Timing header and logged as one
+JSON line at INFO level. Statements slower than SLOW_QUERY_MS are logged
+at WARNING level with their parameters, in which strings, which may hold
+names, emails and phone numbers, are redacted. The lines at LOG_LEVEL
+and above are written to stderr.
+Streamed responses send their headers before the body is read, so the
+header only covers the statements run before streaming starts.
+'''
+
+
+# Replace the values of parameters which may hold personal data
+def redact(parameters):
+    if isinstance(parameters, dict):
+        return {name: redact(value) for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        redacted = [redact(value) for value in parameters[:MAX_LOGGED_ROWS]]
+        if len(parameters) > MAX_LOGGED_ROWS:
+            redacted.append('... {} more'.format(len(parameters) - MAX_LOGGED_ROWS))
+        return redacted
+    if isinstance(parameters, (str, bytes)):
+        return '<redacted>'
+    return parameters
+
+
+# Collapse the whitespace of a statement and truncate it for the logs
+def short_statement(statement):
+    statement = ' '.join(statement.split())
+    if len(statement) > MAX_STATEMENT_LENGTH:
+        statement = statement[:MAX_STATEMENT_LENGTH] + '...'
+    return statement
+
+
+# Statements run while handling one request
+class RequestStats:
+    def __init__(self, slow_query_ms):
+        self.slow_query_ms = slow_query_ms
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement, parameters, seconds):
+        self.queries += 1
+        self.seconds += seconds
+        if seconds > self.slowest_seconds or self.slowest_statement is None:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+        if seconds * 1000 >= self.slow_query_ms:
+            logger.warning(json.dumps({
+                                       'event': 'slow_query',
+                                       'method': request.method,
+                                       'path': request.path,
+                                       'duration_ms': round(seconds * 1000, 3),
+                                       'statement': short_statement(statement),
+                                       'parameters': redact(parameters)
+                                       }, default=str))
+
+    def server_timing(self):
+        timings = ['db;desc="{} queries";dur={:.3f}'.format(self.queries, self.seconds * 1000)]
+        if self.slowest_statement is not None:
+            timings.append('db-slowest;dur={:.3f}'.format(self.slowest_seconds * 1000))
+        timings.append('total;dur={:.3f}'.format((time.perf_counter() - self.started) * 1000))
+        return ', '.join(timings)
+
+    def log(self, status):
+        logger.info(json.dumps({
+                                'event': 'request',
+                                'method': request.method,
+                                'path': request.path,
+                                'status': status,
+                                'duration_ms': round((time.perf_counter() - self.started)
+                                                     * 1000, 3),
+                                'queries': self.queries,
+                                'db_ms': round(self.seconds * 1000, 3),
+                                'slowest_ms': round(self.slowest_seconds * 1000, 3),
+                                'slowest_statement': (short_statement(self.slowest_statement)
+                                                      if self.slowest_statement else None)
+                                }))
+
+
+# Write the lines at level and above to stderr, once each even when the
+# root logger has handlers too
+def configure_logging(level=LOG_LEVEL):
+    logger.setLevel(level)
+    if log_handler not in logger.handlers:
+        logger.addHandler(log_handler)
+    logger.propagate = False
+
+
+def current_stats():
+    if has_request_context():
+        return g.get('query_stats')
+    return None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_stats()
+    started = getattr(context, '_query_started', None)
+    if stats is not None and started is not None:
+        stats.record(statement, parameters, time.perf_counter() - started)
+
+
+# Times the statements of every engine during the requests of the apps
+# passed to init_app
+class QueryStats:
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS, server_timing=SERVER_TIMING,
+                 log_level=LOG_LEVEL):
+        self.slow_query_ms = slow_query_ms
+        self.server_timing = server_timing
+        self.log_level = log_level
+
+    def init_app(self, app):
+        # setup_db may be called again for the same app
+        if 'query_stats' in app.extensions:
+            return
+        app.extensions['query_stats'] = self
+        configure_logging(self.log_level)
+
+        if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+        @app.before_request
+        def start_query_stats():
+            g.query_stats = RequestStats(self.slow_query_ms)
+
+        @app.after_request
+        def finish_query_stats(response):
+            stats = current_stats()
+            if stats is None:
+                return response
+
+            if self.server_timing:
+                response.headers['Server-Timing'] = stats.server_timing()
+            stats.log(response.status_code)
+            return response
+
+
+query_stats = QueryStats()
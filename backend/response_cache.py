@@ -0,0 +1,228 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+from flask import Response, current_app, request
+from versions import table_versions
+
+# Response cache settings. RESPONSE_CACHE_BACKEND is memory, shared or
+# off; the shared backend is a Redis server at RESPONSE_CACHE_URL
+RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL', None)
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 60))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+# Scope of the endpoints which need no permission
+PUBLIC_SCOPE = 'public'
+
+'''
+Response cache
+Bodies of successful GET responses, keyed by route, query arguments,
+permission scope and the versions of the tables the response is built
+from. A write through the model methods bumps the version of its table,
+so every key built from the table changes and the old entries are never
+read again; they age out of the cache by TTL or LRU eviction.
+Protected routes are only cached behind requires_auth and the caller's
+permissions are part of the key, so a response is only ever served to
+callers holding the same permissions as the one it was built for.
+'''
+
+
+# In process LRU cache bounded by the size of keys and bodies in bytes
+class MemoryBackend:
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if self.clock() >= expires_at:
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, self.clock() + self.ttl)
+            self.bytes += size
+
+            # Evict the least recently used entries
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        value, expires_at = self._entries.pop(key)
+        self.bytes -= len(key) + len(value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                    'backend': 'memory',
+                    'entries': len(self._entries),
+                    'bytes': self.bytes,
+                    'max_bytes': self.max_bytes
+                    }
+
+
+# Cache shared by every worker and host, stored in Redis. Any client
+# with the get/set/delete/scan_iter/info methods of redis.Redis can be used
+class SharedBackend:
+    def __init__(self, client, ttl=RESPONSE_CACHE_TTL, prefix='response:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+    # The entries are counted by scanning the keys of the cache. The
+    # server may hold other data, so its memory use is reported as such
+    def stats(self):
+        return {
+                'backend': 'shared',
+                'entries': sum(1 for key in
+                               self.client.scan_iter(match=self.prefix + '*')),
+                'server_used_memory': self.client.info('memory').get('used_memory')
+                }
+
+
+class ResponseCache:
+    def __init__(self, backend=None, versions=table_versions):
+        self.backend = backend
+        self.versions = versions
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    # Key of the current request with the given permission scope,
+    # which changes with the version of any of tables
+    def key(self, scope, tables):
+        args = urlencode(sorted(request.args.items(multi=True)))
+        versions = ','.join('{}-{}'.format(table, self.versions.get(table))
+                            for table in tables)
+        data = '\n'.join((request.path, args, scope, versions))
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    # Return the cached response of the current request, or build it and
+    # cache it when it succeeded. The key is taken before building, so a
+    # response racing a write is stored under the old table versions
+    def respond(self, scope, tables, build):
+        if self.backend is None:
+            return build()
+
+        key = self.key(scope, tables)
+        body = self.backend.get(key)
+        if body is not None:
+            self._count(True)
+            return Response(body, mimetype='application/json')
+
+        self._count(False)
+        response = current_app.make_response(build())
+        if response.status_code == 200 and response.is_json:
+            self.backend.set(key, response.get_data())
+
+        return response
+
+    def clear(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+
+        stats = {
+                 'hits': hits,
+                 'misses': misses,
+                 'hit_ratio': hits / (hits + misses) if hits + misses else None
+                 }
+        if self.backend is not None:
+            stats.update(self.backend.stats())
+        else:
+            stats['backend'] = 'off'
+
+        return stats
+
+
+# Create the backend configured by RESPONSE_CACHE_BACKEND. The redis
+# package is only needed for the shared backend
+def make_backend(name=RESPONSE_CACHE_BACKEND, url=RESPONSE_CACHE_URL):
+    if name == 'off':
+        return None
+    if name == 'memory':
+        return MemoryBackend()
+    if name == 'shared':
+        if url is None:
+            raise RuntimeError('RESPONSE_CACHE_URL is needed by the shared response cache')
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('The shared response cache needs the redis package')
+        return SharedBackend(redis.Redis.from_url(url))
+
+    raise RuntimeError('Unknown RESPONSE_CACHE_BACKEND ' + name)
+
+
+response_cache = ResponseCache(make_backend())
+
+
+# Cache the responses of a GET endpoint built from tables. Put it below
+# requires_auth, which passes the payload of the verified token as the
+# first argument, so only authorized callers reach the cache and their
+# permissions scope the key. Endpoints without auth share a public scope
+def cached(*tables):
+    def cached_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if args:
+                scope = 'permissions:' + ' '.join(sorted(args[0]['permissions']))
+            else:
+                scope = PUBLIC_SCOPE
+
+            return response_cache.respond(scope, tables,
+                                          lambda: f(*args, **kwargs))
+
+        return wrapper
+    return cached_decorator
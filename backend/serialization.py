@@ -0,0 +1,87 @@
+import csv
+import io
+import json
+import re
+from datetime import date
+from flask import Response, current_app, jsonify
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+'''
+JSON responses
+The list endpoints encode their formatted rows with orjson when it is
+installed. For the values the rows hold, strings, integers, booleans,
+None, dates, lists and dicts, the body is the same bytes jsonify sends:
+sorted keys, no whitespace, dates as HTTP dates and only printable
+ASCII, with any other character escaped. orjson writes UTF-8, so a body
+holding anything else is encoded again with the standard library.
+Floats decode to the same values but are written in orjson's own form,
+such as 1e20 instead of 1e+20, and NaN and Infinity as null.
+'''
+
+# Bytes jsonify would have escaped
+NOT_PRINTABLE_ASCII = re.compile(rb'[^\x20-\x7e]')
+
+
+# Encode the values the standard encoders do not handle as Flask does
+def encode_default(value):
+    if isinstance(value, date):
+        return http_date(value.timetuple())
+
+    raise TypeError('{} is not JSON serializable'.format(type(value).__name__))
+
+
+# Encode data as the body of jsonify(data), without the trailing newline
+def dumps(data):
+    if orjson is not None:
+        try:
+            body = orjson.dumps(data, default=encode_default,
+                                option=orjson.OPT_SORT_KEYS
+                                | orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            body = None
+        if body is not None and not NOT_PRINTABLE_ASCII.search(body):
+            return body
+
+    return json.dumps(data, default=encode_default, separators=(',', ':'),
+                      sort_keys=True).encode('ascii')
+
+
+# Drop-in replacement of jsonify for large responses. Debug mode pretty
+# prints JSON, which is left to jsonify
+def json_response(data):
+    if current_app.debug:
+        return jsonify(data)
+
+    return Response(dumps(data) + b'\n', mimetype='application/json')
+
+
+# Encode batches of rows as newline delimited JSON, one chunk per batch
+def ndjson_chunks(batches):
+    for rows in batches:
+        yield b''.join(dumps(row) + b'\n' for row in rows)
+
+
+# Encode batches of rows as CSV with a header of columns, one chunk per
+# batch. Dates are written as in the JSON responses
+def csv_chunks(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+
+    for rows in batches:
+        for row in rows:
+            writer.writerow([encode_default(row[column])
+                             if isinstance(row[column], date) else row[column]
+                             for column in columns])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+    # The header of an empty export
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
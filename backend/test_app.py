@@ -1,11 +1,16 @@
 import os
+import threading
 import unittest
 import json
 from datetime import datetime
+from flask import jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 
 from app import create_app
-from models import setup_db, Artist, Client, Appointment
+from models import (setup_db, db as models_db, search, has_style, Artist,
+                    Client, Appointment)
+from response_cache import response_cache
 
 
 MANAGER_JWT = os.environ.get("MANAGER_JWT")
@@ -33,9 +38,31 @@ class TattooShopTestCase(unittest.TestCase):
             self.db.init_app(self.app)
             self.db.create_all()
 
+        response_cache.clear()
+
     def tearDown(self):
         pass
 
+    # Make a request and return the response along with the number of
+    # SELECT statements it issued
+    def count_selects(self, method, url, **kwargs):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with self.app.app_context():
+            engine = models_db.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            res = getattr(self.client(), method)(url, **kwargs)
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+
+        selects = [statement for statement in statements
+                   if statement.lstrip().upper().startswith('SELECT')]
+        return res, len(selects)
+
     '''
     Test Get endpoints for Artists, Client, and Appointments
     '''
@@ -61,6 +88,365 @@ class TattooShopTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(data['artist']['id'], 2)
 
+    def test_get_artist_availability(self):
+        # Test GET artist availability returns the free intervals around
+        # the artist's appointment at 11:00 and 200 OK status
+        res = self.client().get('/api/artists/3/availability'
+                                '?from=Mon, 09 Aug 2021 08:00:00 GMT'
+                                '&to=Mon, 09 Aug 2021 14:00:00 GMT'
+                                '&duration=60')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['free']), 2)
+        self.assertEqual(data['free'][0]['end'], 'Mon, 09 Aug 2021 11:00:00 GMT')
+        self.assertEqual(data['free'][1]['end'], 'Mon, 09 Aug 2021 14:00:00 GMT')
+
+    def test_get_available_artists(self):
+        # Test GET available artists excludes artists with an
+        # appointment at that time
+        res = self.client().get('/api/artists/available'
+                                '?at=Mon, 09 Aug 2021 11:30:00 GMT')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['artists'])
+        self.assertNotIn(3, [artist['id'] for artist in data['artists']])
+
+    def test_get_artists_not_modified(self):
+        # Test a request with the ETag of the artists returns 304 without
+        # querying the database, with headers a CDN can cache by
+        res = self.client().get('/api/artists')
+        etag = res.headers['ETag']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('public', res.headers['Cache-Control'])
+        self.assertIn('s-maxage', res.headers['Cache-Control'])
+
+        for url in ('/api/artists', '/api/artists/2'):
+            res, selects = self.count_selects('get', url,
+                                              headers={'If-None-Match': etag})
+            self.assertEqual(res.status_code, 304)
+            self.assertEqual(res.headers['ETag'], etag)
+            self.assertEqual(selects, 0)
+
+    def test_artist_write_changes_etag(self):
+        # Test updating an artist changes the ETag of the artist endpoints
+        etag = self.client().get('/api/artists/2').headers['ETag']
+        self.client().patch('/api/artists/2',
+                            json={'phone': '142-323-6123'},
+                            headers={"Authorization": self.manager_jwt})
+
+        res = self.client().get('/api/artists/2',
+                                headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+
+    def test_list_responses_match_format(self):
+        # Test the list endpoints send the bytes jsonify sends for format()
+        headers = {"Authorization": self.manager_jwt}
+        with self.app.app_context():
+            artists = [artist.format() for artist in Artist.query.all()]
+            clients = [client.format() for client in
+                       Client.query.order_by(Client.id).limit(2)]
+            total_clients = Client.query.count()
+            appts = [appt.format(('artist', 'client')) for appt in
+                     Appointment.query.order_by(Appointment.appointment_date,
+                                                Appointment.id).limit(2)]
+
+        expected = {
+            '/api/artists': {'success': True, 'artists': artists,
+                             'total_artists': len(artists)},
+            '/api/clients?per_page=2': {'success': True, 'clients': clients,
+                                        'total_clients': total_clients},
+            '/api/appointments?per_page=2&expand=artist,client': {
+                'success': True, 'appointments': appts}
+        }
+
+        for url, body in expected.items():
+            res = self.client().get(url, headers=headers)
+            data = json.loads(res.data)
+            if 'next_cursor' in data:
+                body['next_cursor'] = data['next_cursor']
+
+            with self.app.test_request_context():
+                self.assertEqual(res.data, jsonify(body).get_data(), url)
+
+    def test_pool_stats(self):
+        # Test the connection pool reports its checkouts, with every
+        # connection returned after a request
+        self.client().get('/api/artists')
+
+        res = self.client().get('/api/pool/stats',
+                                headers={"Authorization": self.manager_jwt})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(data['pool']['pool'], ('TimedQueuePool', 'TimedNullPool'))
+        self.assertGreater(data['pool']['checkouts'], 0)
+        self.assertEqual(data['pool']['in_use'], 0)
+
+    def test_health_live(self):
+        # Test the liveness check answers without dependencies
+        res = self.client().get('/health/live')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['status'], 'live')
+
+    def test_health_ready(self):
+        # Test the readiness check probes the database and signing keys
+        res = self.client().get('/health/ready')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(data['checks']['database']['ok'])
+        self.assertTrue(data['checks']['jwks']['ok'])
+        self.assertGreater(data['checks']['jwks']['keys'], 0)
+        self.assertIn('latency_ms', data['checks']['database'])
+
+    def test_server_timing(self):
+        # Test responses report the statements run for the request
+        res = self.client().get('/api/artists/2')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('db;desc="1 queries"', res.headers['Server-Timing'])
+
+    def test_metrics(self):
+        # Test the metrics cover requests, token checks and the pool
+        self.client().get('/api/clients', headers={"Authorization": self.manager_jwt})
+
+        res = self.client().get('/metrics')
+        body = res.data.decode('utf-8')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith('text/plain'))
+        self.assertIn('http_requests_total{method="GET",route="/api/clients",status="200"}',
+                      body)
+        self.assertIn('http_request_db_seconds_count{method="GET",route="/api/clients"}',
+                      body)
+        self.assertIn('auth_duration_seconds_count{step="requires_auth"}', body)
+        self.assertIn('db_pool_checkouts_total', body)
+
+    def test_export_ndjson(self):
+        # Test an export streams every row in id order, resuming after id 2
+        headers = {"Authorization": self.manager_jwt}
+        with self.app.app_context():
+            expected = [json.loads(json.dumps(client.format())) for client in
+                        Client.query.filter(Client.id > 2).order_by(Client.id)]
+
+        res = self.client().get('/api/export/clients?after=2', headers=headers)
+        rows = [json.loads(line) for line in res.data.splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(rows, expected)
+
+    def test_export_csv(self):
+        # Test a CSV export has a header and a line per appointment
+        res = self.client().get('/api/export/appointments?format=csv',
+                                headers={"Authorization": self.manager_jwt})
+        lines = res.data.decode('utf-8').splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/csv')
+        self.assertEqual(lines[0], 'id,artist,client,appointment_date,duration')
+        with self.app.app_context():
+            self.assertEqual(len(lines) - 1, Appointment.query.count())
+
+    def test_export_error(self):
+        # Test unknown tables and formats, and callers without get:all
+        headers = {"Authorization": self.manager_jwt}
+        requests = [
+                    ('/api/export/styles', headers, 404),
+                    ('/api/export/artists?format=xml', headers, 422),
+                    ('/api/export/clients', {"Authorization": self.client_jwt}, 401)
+                    ]
+
+        for url, request_headers, status in requests:
+            res = self.client().get(url, headers=request_headers)
+
+            self.assertEqual(res.status_code, status, url)
+            self.assertEqual(json.loads(res.data)['success'], False)
+
+    def test_cached_response(self):
+        # Test a repeated GET is answered from the response cache without
+        # querying the database
+        headers = {"Authorization": self.manager_jwt}
+        res = self.client().get('/api/clients/2', headers=headers)
+        cached, selects = self.count_selects('get', '/api/clients/2',
+                                             headers=headers)
+
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(cached.data, res.data)
+        self.assertEqual(selects, 0)
+        self.assertEqual(response_cache.stats()['hits'], 1)
+
+    def test_cached_response_follows_writes(self):
+        # Test a write through the model methods replaces the cached response
+        headers = {"Authorization": self.manager_jwt}
+        self.client().get('/api/clients/2', headers=headers)
+        self.client().patch('/api/clients/2', json={'phone': '555-010-2030'},
+                            headers=headers)
+
+        res = self.client().get('/api/clients/2', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(data['client']['phone'], '555-010-2030')
+        self.assertEqual(response_cache.stats()['hits'], 0)
+
+    def test_cached_response_needs_permission(self):
+        # Test a cached protected response is not served to callers
+        # without get:all
+        self.client().get('/api/clients',
+                          headers={"Authorization": self.manager_jwt})
+
+        res = self.client().get('/api/clients',
+                                headers={"Authorization": self.client_jwt})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(data['success'], False)
+        self.assertNotIn('clients', data)
+
+    def test_cache_stats(self):
+        # Test the hit ratio and memory use of the response cache
+        self.client().get('/api/artists/search?q=ink')
+        self.client().get('/api/artists/search?q=ink')
+
+        res = self.client().get('/api/cache/stats',
+                                headers={"Authorization": self.manager_jwt})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['response_cache']['hit_ratio'], 0.5)
+        self.assertEqual(data['response_cache']['entries'], 1)
+        self.assertGreater(data['response_cache']['bytes'], 0)
+
+    def test_get_artists_by_style(self):
+        # Test GET artists filtered by style matches the style case
+        # insensitively and still returns the styles as entered
+        res = self.client().get('/api/artists?style=JAPANESE')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([artist['id'] for artist in data['artists']], [4])
+        self.assertEqual(data['artists'][0]['styles'], 'Japanese')
+
+    def test_artist_styles_follow_writes(self):
+        # Test the style filter sees styles of created, bulk created and
+        # updated artists
+        suffix = datetime.now().strftime('%H%M%S%f')
+        headers = {"Authorization": self.manager_jwt}
+        created = self.client().post('/api/artists', headers=headers, json={
+                                     'name': 'Style Artist A ' + suffix,
+                                     'styles': 'Dotwork, Fine  Line'
+                                     }).get_json()['artist']['id']
+        bulk_created = self.client().post('/api/artists/bulk', headers=headers, json=[{
+                                          'name': 'Style Artist B ' + suffix,
+                                          'styles': 'fine line / Ornamental'
+                                          }]).get_json()['results'][0]['artist']['id']
+        self.client().patch(f'/api/artists/{created}', headers=headers,
+                            json={'styles': 'Dotwork'})
+
+        def artists_with(style):
+            data = self.client().get('/api/artists?style=' + style).get_json()
+            return {artist['id'] for artist in data['artists']}
+
+        self.assertIn(created, artists_with('dotwork'))
+        self.assertNotIn(created, artists_with('fine line'))
+        self.assertIn(bulk_created, artists_with('fine line'))
+        self.assertIn(bulk_created, artists_with('ornamental'))
+
+    def test_style_filter_uses_index(self):
+        # Test the style filter is planned through the artists by style
+        # index on 5000 seeded artists with 100 styles. The seeded rows are
+        # rolled back afterwards
+        with self.app.app_context():
+            connection = models_db.engine.connect()
+            query = Artist.query.filter(has_style('seeded style 7'))
+        transaction = connection.begin()
+        try:
+            connection.execute(
+                "INSERT INTO styles (name) "
+                "SELECT 'seeded style ' || i FROM generate_series(1, 100) AS i")
+            connection.execute(
+                "INSERT INTO artists (name, styles) "
+                "SELECT 'Style Index Artist ' || i, 'Seeded Style ' || mod(i, 100) "
+                "FROM generate_series(1, 5000) AS i")
+            connection.execute(
+                "INSERT INTO artist_styles (artist_id, style_id) "
+                "SELECT artists.id, styles.id FROM artists "
+                "JOIN styles ON styles.name = lower(artists.styles) "
+                "WHERE artists.name LIKE 'Style Index Artist %%'")
+            connection.execute('ANALYZE')
+
+            compiled = query.statement.compile(dialect=connection.dialect)
+            plan = '\n'.join(row[0] for row in connection.execute(
+                                        'EXPLAIN ' + str(compiled), compiled.params))
+            self.assertIn('ix_artist_styles_style_id_artist_id', plan)
+        finally:
+            transaction.rollback()
+            connection.close()
+
+    def test_search_artists(self):
+        # Test GET artists search returns the best match first
+        res = self.client().get('/api/artists/search?q=lebron')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['artists'][0]['id'], 2)
+        self.assertIsNone(data['next_page'])
+
+    def test_search_artists_by_style(self):
+        # Test GET artists search filtered by style only returns artists
+        # with that style
+        res = self.client().get('/api/artists/search?style=japanese')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([artist['id'] for artist in data['artists']], [4])
+
+    def test_search_clients(self):
+        # Test GET clients search matches misspelled names
+        res = self.client().get('/api/clients/search?q=patrik',
+                                headers={
+                                         "Authorization": self.manager_jwt
+                                         })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['clients'][0]['id'], 1)
+
+    def test_search_uses_index(self):
+        # Test the client search is planned as a scan of the trigram
+        # index on 20000 seeded clients. The seeded rows are rolled back
+        with self.app.app_context():
+            connection = models_db.engine.connect()
+            query = search(Client, 'search client 12345').limit(10)
+        transaction = connection.begin()
+        try:
+            connection.execute(
+                "INSERT INTO clients (name, email, phone) "
+                "SELECT 'Search Client ' || i, 'search' || i || '@example.com', "
+                "lpad(i::text, 10, '0') "
+                "FROM generate_series(1, 20000) AS i")
+            connection.execute('ANALYZE clients')
+
+            compiled = query.statement.compile(dialect=connection.dialect)
+            plan = '\n'.join(row[0] for row in connection.execute(
+                                        'EXPLAIN ' + str(compiled), compiled.params))
+            self.assertIn('ix_clients_search', plan)
+        finally:
+            transaction.rollback()
+            connection.close()
+
     def test_get_all_clients(self):
         # Test GET all clients endpoint returns:
         # all clients and 200 OK status
@@ -75,6 +461,27 @@ class TattooShopTestCase(unittest.TestCase):
         self.assertTrue(data['clients'])
         self.assertTrue(data['total_clients'])
 
+    def test_get_clients_per_page(self):
+        # Test GET clients with per_page returns that many clients and
+        # a cursor which continues after the last client
+        headers = {"Authorization": self.manager_jwt}
+        res = self.client().get('/api/clients?per_page=2', headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['clients']), 2)
+        self.assertTrue(data['next_cursor'])
+
+        next_res = self.client().get('/api/clients?per_page=2&cursor={}'
+                                     .format(data['next_cursor']),
+                                     headers=headers)
+        next_data = json.loads(next_res.data)
+
+        self.assertEqual(next_res.status_code, 200)
+        self.assertGreater(next_data['clients'][0]['id'],
+                           data['clients'][-1]['id'])
+        self.assertEqual(next_data['total_clients'], data['total_clients'])
+
     def test_get_client_by_id(self):
         # Test GET client according to artist_id returns
         # client id and 200 OK status
@@ -102,6 +509,163 @@ class TattooShopTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(data['appointment']['id'], 2)
 
+    def test_get_all_appointments(self):
+        # Test GET appointments returns a page of appointments ordered by
+        # date and a cursor which continues after the last one
+        headers = {"Authorization": self.manager_jwt}
+        res = self.client().get('/api/appointments?per_page=1',
+                                headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['appointments']), 1)
+        self.assertTrue(data['next_cursor'])
+
+        next_res = self.client().get('/api/appointments?per_page=1&cursor={}'
+                                     .format(data['next_cursor']),
+                                     headers=headers)
+        next_data = json.loads(next_res.data)
+
+        self.assertEqual(next_res.status_code, 200)
+        self.assertNotEqual(next_data['appointments'][0]['id'],
+                            data['appointments'][0]['id'])
+
+    def test_get_appointments_by_artist(self):
+        # Test GET appointments filtered by artist only returns
+        # appointments with that artist
+        res = self.client().get('/api/appointments?artist=2',
+                                headers={
+                                        "Authorization": self.manager_jwt
+                                        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['appointments'])
+        for appointment in data['appointments']:
+            self.assertEqual(appointment['artist'], 2)
+
+    def test_get_appointment_expanded(self):
+        # Test GET appointment with expand embeds the artist and client
+        # objects in place of their ids
+
+        res = self.client().get('/api/appointments/2?expand=artist,client',
+                                headers={
+                                        "Authorization": self.manager_jwt
+                                        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['appointment']['id'], 2)
+        self.assertTrue(data['appointment']['artist']['name'])
+        self.assertTrue(data['appointment']['client']['name'])
+
+    def test_single_resource_query_count(self):
+        # Test GET and PATCH of a single resource load it with one SELECT
+        headers = {"Authorization": self.manager_jwt}
+        requests = [
+                    ('get', '/api/artists/2', {}),
+                    ('get', '/api/clients/2', {'headers': headers}),
+                    ('get', '/api/appointments/2', {'headers': headers}),
+                    ('get', '/api/appointments/2?expand=artist,client',
+                     {'headers': headers}),
+                    ('patch', '/api/artists/2',
+                     {'headers': headers, 'json': {'phone': '142-323-6123'}}),
+                    ('patch', '/api/clients/2',
+                     {'headers': headers, 'json': {}}),
+                    ('patch', '/api/appointments/2',
+                     {'headers': headers, 'json': {}})
+                    ]
+
+        for method, url, kwargs in requests:
+            res, selects = self.count_selects(method, url, **kwargs)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(selects, 1, '{} {}'.format(method.upper(), url))
+
+    def test_delete_query_count(self):
+        # Test DELETE of a single resource loads it with one SELECT and
+        # leaves its appointments and styles to the database. The only
+        # other SELECT counts the total reported, which the delete dropped
+        headers = {"Authorization": self.manager_jwt}
+        with self.app.app_context():
+            artist = Artist('Delete Count Artist', styles='Realism, Blackwork')
+            artist.insert()
+            client = Client('Delete Count Client')
+            client.insert()
+            appts = [Appointment(artist=artist.id, client=client.id,
+                                 appointment_date=datetime(2090, 1, 1, hour))
+                     for hour in (10, 12, 14)]
+            for appt in appts:
+                appt.insert()
+            ids = (artist.id, client.id, [appt.id for appt in appts])
+            models_db.session.remove()
+
+        artist_id, client_id, appt_ids = ids
+        for url in ('/api/appointments/{}'.format(appt_ids[0]),
+                    '/api/artists/{}'.format(artist_id),
+                    '/api/clients/{}'.format(client_id)):
+            res, selects = self.count_selects('delete', url, headers=headers)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(selects, 2, 'DELETE ' + url)
+
+        # The database nulled the artist and client of the appointments
+        with self.app.app_context():
+            for appt_id in appt_ids[1:]:
+                appt = Appointment.query.get(appt_id)
+                self.assertIsNone(appt.artist)
+                self.assertIsNone(appt.client)
+                appt.delete()
+
+    def test_appointment_lookups_use_indexes(self):
+        # Test the appointment lookups are planned as index scans on a
+        # seeded calendar of 200 artists and 1000 clients. The seeded rows
+        # are rolled back afterwards
+        queries = {
+            'ix_appointment_artist_appointment_date': (
+                "SELECT * FROM appointment WHERE artist = {artist} "
+                "AND appointment_date >= '2003-01-01' "
+                "AND appointment_date < '2003-02-01'"),
+            'ix_appointment_client_appointment_date': (
+                "SELECT * FROM appointment WHERE client = {client} "
+                "AND appointment_date >= '2003-01-01' "
+                "AND appointment_date < '2003-02-01'"),
+            'ix_appointment_appointment_date': (
+                "SELECT count(appointment.id) FROM appointment "
+                "WHERE appointment_date > now()")
+        }
+
+        with self.app.app_context():
+            connection = models_db.engine.connect()
+        transaction = connection.begin()
+        try:
+            artist = connection.execute(
+                "INSERT INTO artists (name) "
+                "SELECT 'Index Test Artist ' || i "
+                "FROM generate_series(1, 200) AS i RETURNING id").fetchall()
+            client = connection.execute(
+                "INSERT INTO clients (name) "
+                "SELECT 'Index Test Client ' || i "
+                "FROM generate_series(1, 1000) AS i RETURNING id").fetchall()
+            connection.execute(
+                "INSERT INTO appointment (artist, client, appointment_date) "
+                "SELECT {artist} + mod(i, 200), {client} + mod(i, 1000), "
+                "timestamp '2000-01-01' + i * interval '1 hour' "
+                "FROM generate_series(1, 50000) AS i".format(
+                    artist=artist[0][0], client=client[0][0]))
+            connection.execute('ANALYZE appointment')
+
+            for index, query in queries.items():
+                query = query.format(artist=artist[0][0], client=client[0][0])
+                plan = '\n'.join(row[0] for row in
+                                 connection.execute('EXPLAIN ' + query))
+                self.assertIn(index, plan)
+        finally:
+            transaction.rollback()
+            connection.close()
+
     '''
     Test POST Endpoints for Artist, Client, Appointment
     '''
@@ -130,6 +694,42 @@ class TattooShopTestCase(unittest.TestCase):
         self.assertEqual(data['artist']['name'], payload['name'])
         self.assertTrue(data['total_artists'])
 
+    def test_bulk_create_artists(self):
+        # Test bulk post request for artists returns:
+        # each new artist with its id and 200 OK status
+        suffix = datetime.now().strftime('%H%M%S%f')
+        payload = [
+                   {'name': 'Bulk Artist A ' + suffix, 'styles': 'Blackwork'},
+                   {'name': 'Bulk Artist B ' + suffix}
+                   ]
+
+        res = self.client().post('/api/artists/bulk',
+                                 headers={"Authorization": self.manager_jwt},
+                                 json=payload
+                                 )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['results']), 2)
+        for result, row in zip(data['results'], payload):
+            self.assertTrue(result['artist']['id'])
+            self.assertEqual(result['artist']['name'], row['name'])
+        self.assertTrue(data['total_artists'])
+
+    def test_bulk_create_clients_ndjson(self):
+        # Test bulk post request for clients accepts NDJSON
+        rows = [{'name': 'Bulk Client {}'.format(i)} for i in range(3)]
+        res = self.client().post('/api/clients/bulk',
+                                 headers={"Authorization": self.manager_jwt},
+                                 data='\n'.join(json.dumps(row) for row in rows),
+                                 content_type='application/x-ndjson'
+                                 )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['results']), 3)
+
     def test_create_client(self):
         # Test post request for client endpoint returns:
         # new client attributes and 200 OK status
@@ -157,7 +757,7 @@ class TattooShopTestCase(unittest.TestCase):
         payload = {
                    'client': 1,
                    'artist': 1,
-                   'appointment_date': datetime(2021, 3, 6, 12, 30)
+                   'appointment_date': datetime(2021, 3, 6, 14, 30)
                    }
         res = self.client().post('/api/appointments',
                                  json=payload,
@@ -172,6 +772,46 @@ class TattooShopTestCase(unittest.TestCase):
         self.assertEqual(data['appointment']['id'], last_appt)
         self.assertEqual(data['appointment']['artist'], payload['artist'])
         self.assertEqual(data['appointment']['client'], payload['client'])
+        self.assertEqual(data['appointment']['duration'], 60)
+
+    def test_concurrent_bookings(self):
+        # Test concurrent requests booking the same artist at overlapping
+        # times create one appointment and return 409 for the others
+        workers = 8
+        barrier = threading.Barrier(workers)
+        responses = []
+
+        def book(minutes):
+            payload = {
+                       'client': 2,
+                       'artist': 4,
+                       'appointment_date': datetime(2031, 5, 1, 10, minutes),
+                       'duration': 90
+                       }
+            client = self.client()
+            barrier.wait()
+            res = client.post('/api/appointments', json=payload,
+                              headers={"Authorization": self.manager_jwt})
+            responses.append((res.status_code, json.loads(res.data)))
+
+        threads = [threading.Thread(target=book, args=(minutes,))
+                   for minutes in range(0, workers * 5, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        created = [data for status, data in responses if status == 200]
+        conflicts = [data for status, data in responses if status == 409]
+        self.assertEqual(len(created), 1)
+        self.assertEqual(len(conflicts), workers - 1)
+        for data in conflicts:
+            self.assertEqual(data['conflicting_appointment_id'],
+                             created[0]['appointment']['id'])
+
+        self.client().delete('/api/appointments/{}'.format(
+                                 created[0]['appointment']['id']),
+                             headers={"Authorization": self.manager_jwt})
 
     '''
     Test PATCH Endpoints for Artist, Client, Appointment
@@ -310,6 +950,28 @@ class TattooShopTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertTrue(data['message'])
 
+    # Test availability without a date range returns 422
+    def test_get_artist_availability_error(self):
+
+        res = self.client().get('/api/artists/3/availability'
+                                '?from=Mon, 09 Aug 2021 08:00:00 GMT')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(data['message'])
+
+    def test_search_clients_error(self):
+        # Test a search without terms returns 422
+        res = self.client().get('/api/clients/search?q=',
+                                headers={
+                                         "Authorization": self.manager_jwt
+                                         })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
     # Test request for clients page that does not exist returns 404
     def test_get_all_clients_error(self):
 
@@ -334,6 +996,30 @@ class TattooShopTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertTrue(data['message'])
 
+    # Test request for appointments with a malformed cursor returns 422
+    def test_get_all_appointments_cursor_error(self):
+
+        res = self.client().get('/api/appointments?cursor=not-a-cursor',
+                                headers={"Authorization": self.manager_jwt}
+                                )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(data['message'])
+
+    # Test request for an unknown expand value returns 422
+    def test_get_appointment_expand_error(self):
+
+        res = self.client().get('/api/appointments/2?expand=tattoo',
+                                headers={"Authorization": self.manager_jwt}
+                                )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(data['message'])
+
     # Test request for appointment that does not exist returns 404
     def test_get_appointment_by_id_error(self):
 
@@ -369,6 +1055,25 @@ class TattooShopTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertTrue(data['message'])
 
+    # Test a bulk request with an invalid row inserts nothing and
+    # returns the errors of each row
+    def test_bulk_create_artists_error(self):
+        payload = [
+                   {'name': 'Valid Bulk Artist'},
+                   {'phone': '123-456-7891'}
+                   ]
+        res = self.client().post('/api/artists/bulk',
+                                 json=payload,
+                                 headers={"Authorization": self.manager_jwt}
+                                 )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertTrue(data['results'][0]['success'])
+        self.assertFalse(data['results'][1]['success'])
+        self.assertTrue(data['results'][1]['errors'])
+
     # Test creating an client without a name returns a 422 error
     def test_create_client_error(self):
         payload = {
@@ -402,6 +1107,49 @@ class TattooShopTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertTrue(data['message'])
 
+    def test_create_appointment_conflict(self):
+        # Test booking an artist during one of their appointments returns:
+        # 409 with the id of the appointment it overlaps
+        payload = {
+                   'client': 2,
+                   'artist': 1,
+                   'appointment_date': datetime(2021, 3, 6, 12, 30)
+                   }
+        res = self.client().post('/api/appointments',
+                                 json=payload,
+                                 headers={"Authorization": self.manager_jwt}
+                                 )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['conflicting_appointment_id'], 1)
+
+    def test_bulk_create_appointments_conflict(self):
+        # Test bulk appointments overlapping an existing appointment or an
+        # earlier row are rejected and nothing is inserted
+        payload = [
+                   {'artist': 3, 'client': 1,
+                    'appointment_date': 'Mon, 09 Aug 2021 11:30:00 GMT'},
+                   {'artist': 4, 'client': 1,
+                    'appointment_date': 'Mon, 05 Jul 2021 10:00:00 GMT',
+                    'duration': 120},
+                   {'artist': 4, 'client': 2,
+                    'appointment_date': 'Mon, 05 Jul 2021 11:00:00 GMT'}
+                   ]
+        before = Appointment.query.count()
+        res = self.client().post('/api/appointments/bulk',
+                                 headers={"Authorization": self.manager_jwt},
+                                 json=payload
+                                 )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['results'][0]['errors'], ['overlaps appointment 3'])
+        self.assertTrue(data['results'][1]['success'])
+        self.assertEqual(data['results'][2]['errors'], ['overlaps row 1'])
+        self.assertEqual(Appointment.query.count(), before)
+
     '''
     Test Errors for PATCH Endpoints for Artist, Client, Appointment
     '''
@@ -493,6 +1241,25 @@ class TattooShopTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertTrue(data['message'])
 
+    def test_update_appointment_conflict(self):
+        # Test moving an appointment onto another booking of the artist
+        # returns 409 and leaves the appointment unchanged
+        payload = {
+                    'artist': 3,
+                    'appointment_date': datetime(2021, 8, 9, 11, 30)
+                    }
+
+        res = self.client().patch('/api/appointments/4',
+                                  json=payload,
+                                  headers={"Authorization": self.manager_jwt}
+                                  )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(data['conflicting_appointment_id'], 3)
+        self.assertEqual(Appointment.query.get(4).appointment_date,
+                         datetime(2021, 1, 1, 12, 0))
+
     '''
     Test Errors for DELETE Endpoints for Artist, Client, Appointment
     '''
@@ -0,0 +1,367 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from Crypto.PublicKey import RSA
+from flask import Flask, jsonify
+from jose import jwt
+from jose.utils import long_to_base64
+
+os.environ.setdefault('AUTH0_DOMAIN', 'tattoo-api.test')
+os.environ.setdefault('ALGORITHMS', 'RS256')
+os.environ.setdefault('API_AUDIENCE', 'https://tattoo-api')
+
+from app import create_app
+from auth import auth
+from auth.auth import (AuthError, JWKSCache, TokenCache, jwks_file_fetcher,
+                       requires_auth, verify_decode_jwt)
+
+
+# Build a signing key and the matching JWKS document
+def make_signing_key(kid):
+    key = RSA.generate(2048)
+    jwk = {
+        'kty': 'RSA',
+        'kid': kid,
+        'use': 'sig',
+        'n': long_to_base64(key.n).decode('ascii'),
+        'e': long_to_base64(key.e).decode('ascii')
+    }
+    return key.export_key('PEM').decode('ascii'), jwk
+
+
+# Sign a token the way Auth0 would for the given permissions
+def make_token(private_key, kid, permissions, expires_in=60):
+    claims = {
+        'iss': 'https://' + auth.AUTH0_DOMAIN + '/',
+        'aud': auth.API_AUDIENCE,
+        'exp': int(time.time()) + expires_in,
+        'permissions': permissions
+    }
+    return jwt.encode(claims, private_key, algorithm='RS256',
+                      headers={'kid': kid})
+
+
+# Read the public modulus back from a constructed key object
+def modulus(key):
+    return key.to_dict()['n']
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class JWKSCacheTestCase(unittest.TestCase):
+    # This class represents the JWKS key store test case
+
+    @classmethod
+    def setUpClass(cls):
+        cls.private_key, cls.jwk = make_signing_key('test-key')
+        cls.other_private_key, cls.other_jwk = make_signing_key('rotated-key')
+
+    def setUp(self):
+        self.fetches = 0
+        self.jwks = {'keys': [self.jwk]}
+        self.fail = False
+        self.clock = FakeClock()
+        self.spawned = []
+        self.cache = JWKSCache(fetcher=self.fetch, ttl=600,
+                               refresh_interval=30, clock=self.clock,
+                               spawn=self.spawn)
+
+    # Run background refreshes when the test calls run_spawned
+    def spawn(self, target):
+        self.spawned.append(target)
+
+    def run_spawned(self):
+        while self.spawned:
+            self.spawned.pop(0)()
+
+    def fetch(self):
+        self.fetches += 1
+        if self.fail:
+            raise OSError('JWKS source unavailable')
+        return self.jwks
+
+    def test_keys_loaded_once(self):
+        # Test keys are fetched once and then served from memory
+        for _ in range(10):
+            self.assertEqual(modulus(self.cache.get_key('test-key')), self.jwk['n'])
+
+        self.assertEqual(self.fetches, 1)
+
+    def test_keys_constructed_once(self):
+        # Test the same key object is reused across lookups
+        first = self.cache.get_key('test-key')
+
+        self.assertIs(self.cache.get_key('test-key'), first)
+
+    def test_keys_expire_after_ttl(self):
+        # Test the key set is refetched once the ttl has passed
+        self.cache.get_key('test-key')
+        self.clock.now = 601
+        self.cache.get_key('test-key')
+        self.run_spawned()
+
+        self.assertEqual(self.fetches, 2)
+        self.assertFalse(self.cache.is_stale())
+
+    def test_expired_keys_refreshed_in_background(self):
+        # Test expired keys are served while a single refetch runs in the
+        # background
+        self.cache.get_key('test-key')
+        self.clock.now = 601
+
+        for _ in range(5):
+            self.assertEqual(modulus(self.cache.get_key('test-key')), self.jwk['n'])
+
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(len(self.spawned), 1)
+        self.run_spawned()
+        self.assertEqual(self.fetches, 2)
+
+    def test_unknown_kid_refetches_once(self):
+        # Test an unknown kid triggers a single rate limited refetch
+        self.cache.get_key('test-key')
+        self.clock.now = 31
+        self.jwks = {'keys': [self.jwk, self.other_jwk]}
+
+        self.assertEqual(modulus(self.cache.get_key('rotated-key')),
+                         self.other_jwk['n'])
+        self.assertIsNone(self.cache.get_key('missing-key'))
+        self.assertIsNone(self.cache.get_key('missing-key'))
+        self.assertEqual(self.fetches, 2)
+
+    def test_concurrent_first_load_fetches_once(self):
+        # Test requests waiting on a slow first fetch reuse its keys
+        # instead of fetching one after another
+        def slow_fetch():
+            time.sleep(0.2)
+            return self.fetch()
+
+        cache = JWKSCache(fetcher=slow_fetch, ttl=600, refresh_interval=0)
+        keys = []
+        threads = [threading.Thread(target=lambda: keys.append(cache.get_key('test-key')))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual([modulus(key) for key in keys], [self.jwk['n']] * 8)
+
+    def test_stale_keys_served_when_refresh_fails(self):
+        # Test expired keys are kept when the refetch fails
+        self.cache.get_key('test-key')
+        self.clock.now = 601
+        self.fail = True
+
+        self.assertEqual(modulus(self.cache.get_key('test-key')), self.jwk['n'])
+        self.run_spawned()
+        self.assertEqual(modulus(self.cache.get_key('test-key')), self.jwk['n'])
+        self.assertTrue(self.cache.is_stale())
+
+    def test_no_keys_available(self):
+        # Test a failed first load raises a 503 AuthError
+        self.fail = True
+
+        with self.assertRaises(AuthError) as context:
+            self.cache.get_key('test-key')
+
+        self.assertEqual(context.exception.status_code, 503)
+
+    def test_check(self):
+        # Test the readiness check loads the keys and reports stale keys
+        self.assertEqual(self.cache.check(), {'keys': 1, 'age_seconds': 0, 'stale': False})
+
+        self.clock.now = 601
+        self.fail = True
+        self.assertEqual(self.cache.check(), {'keys': 1, 'age_seconds': 601, 'stale': True})
+        self.assertEqual(len(self.spawned), 1)
+
+    def test_check_without_keys(self):
+        # Test the readiness check fails when no keys can be loaded
+        self.fail = True
+
+        with self.assertRaises(AuthError):
+            self.cache.check()
+
+    def test_file_fetcher(self):
+        # Test keys can be loaded from a local JWKS file
+        with tempfile.NamedTemporaryFile('w', suffix='.json',
+                                         delete=False) as jwks_file:
+            json.dump(self.jwks, jwks_file)
+        self.addCleanup(os.remove, jwks_file.name)
+
+        cache = JWKSCache(fetcher=jwks_file_fetcher(jwks_file.name))
+
+        self.assertEqual(modulus(cache.get_key('test-key')), self.jwk['n'])
+
+    def test_verify_decode_jwt_with_local_jwks(self):
+        # Test a token signed by a local key decodes against the cache
+        auth.jwks_cache.set_fetcher(self.fetch)
+        self.addCleanup(auth.jwks_cache.set_fetcher, auth.fetch_jwks)
+
+        token = make_token(self.private_key, 'test-key', ['get:all'])
+
+        payload = verify_decode_jwt(token)
+
+        self.assertEqual(payload['permissions'], ['get:all'])
+        self.assertEqual(self.fetches, 1)
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    # This class represents the verified token cache test case
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.clock.now = 1000
+        self.cache = TokenCache(maxsize=2, ttl=300, clock=self.clock)
+
+    def test_hit_and_miss_counters(self):
+        # Test lookups are counted as hits and misses
+        self.assertIsNone(self.cache.get('token'))
+        self.cache.set('token', {'exp': 2000})
+
+        self.assertEqual(self.cache.get('token'), {'exp': 2000})
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_entry_expires_at_token_exp(self):
+        # Test an entry expires at the token exp when it is before the ttl
+        self.cache.set('token', {'exp': 1100})
+        self.clock.now = 1100
+
+        self.assertIsNone(self.cache.get('token'))
+
+    def test_entry_expires_at_ttl(self):
+        # Test an entry expires at the ttl when it is before the token exp
+        self.cache.set('token', {'exp': 5000})
+        self.clock.now = 1299
+        self.assertIsNotNone(self.cache.get('token'))
+
+        self.clock.now = 1300
+        self.assertIsNone(self.cache.get('token'))
+
+    def test_expired_token_not_cached(self):
+        # Test a payload that has already expired is never stored
+        self.cache.set('token', {'exp': 900})
+
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_least_recently_used_evicted(self):
+        # Test the cache stays bounded by evicting the oldest entry
+        self.cache.set('first', {'exp': 2000})
+        self.cache.set('second', {'exp': 2000})
+        self.cache.get('first')
+        self.cache.set('third', {'exp': 2000})
+
+        self.assertIsNotNone(self.cache.get('first'))
+        self.assertIsNone(self.cache.get('second'))
+        self.assertEqual(self.cache.stats()['size'], 2)
+
+
+class RequiresAuthTestCase(unittest.TestCase):
+    # This class represents the requires_auth decorator test case
+
+    @classmethod
+    def setUpClass(cls):
+        cls.private_key, cls.jwk = make_signing_key('test-key')
+
+    def setUp(self):
+        self.decodes = 0
+        auth.jwks_cache.set_fetcher(lambda: {'keys': [self.jwk]})
+        self.addCleanup(auth.jwks_cache.set_fetcher, auth.fetch_jwks)
+        auth.token_cache.clear()
+        self.addCleanup(auth.token_cache.clear)
+
+        original_decode = auth.verify_decode_jwt
+
+        def counting_decode(token):
+            self.decodes += 1
+            return original_decode(token)
+
+        auth.verify_decode_jwt = counting_decode
+        self.addCleanup(setattr, auth, 'verify_decode_jwt', original_decode)
+
+        app = Flask(__name__)
+
+        @app.route('/protected')
+        @requires_auth('get:all')
+        def protected(payload):
+            return jsonify({'success': True})
+
+        self.client = app.test_client
+
+    def test_repeated_token_decoded_once(self):
+        # Test the same bearer token is only verified on the first request
+        token = make_token(self.private_key, 'test-key', ['get:all'])
+        headers = {'Authorization': 'Bearer ' + token}
+
+        for _ in range(5):
+            res = self.client().get('/protected', headers=headers)
+            self.assertEqual(res.status_code, 200)
+
+        self.assertEqual(self.decodes, 1)
+        self.assertEqual(auth.token_cache.stats()['hits'], 4)
+
+    def test_cached_payload_permissions_checked(self):
+        # Test permissions are checked against the cached payload
+        token = make_token(self.private_key, 'test-key', ['get:appointment'])
+        headers = {'Authorization': 'Bearer ' + token}
+
+        for _ in range(2):
+            res = self.client().get('/protected', headers=headers)
+            self.assertEqual(res.status_code, 401)
+
+        self.assertEqual(self.decodes, 1)
+
+
+class AuthErrorResponseTestCase(unittest.TestCase):
+    # This class represents the auth error responses of the app test case
+
+    @classmethod
+    def setUpClass(cls):
+        cls.private_key, cls.jwk = make_signing_key('test-key')
+
+    def setUp(self):
+        auth.token_cache.clear()
+        self.addCleanup(auth.token_cache.clear)
+        self.addCleanup(auth.jwks_cache.set_fetcher, auth.fetch_jwks)
+        self.client = create_app().test_client
+
+    def test_missing_header(self):
+        # Test a request without a token is answered 401 with the reason
+        res = self.client().get('/api/clients')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['code'], 'authorization_header_missing')
+
+    def test_signing_keys_unavailable(self):
+        # Test a request is answered 503 while no signing keys can be fetched
+        def fail():
+            raise OSError('JWKS source unavailable')
+
+        auth.jwks_cache.set_fetcher(fail)
+        token = make_token(self.private_key, 'test-key', ['get:client'])
+        res = self.client().get('/api/clients',
+                                headers={'Authorization': 'Bearer ' + token})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data['error'], 503)
+        self.assertEqual(data['code'], 'jwks_unavailable')
+
+
+if __name__ == '__main__':
+    unittest.main()
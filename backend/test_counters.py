@@ -0,0 +1,84 @@
+import unittest
+
+from counters import CounterCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class CounterCacheTestCase(unittest.TestCase):
+    # This class represents the counter cache test case
+
+    def setUp(self):
+        self.rows = 10
+        self.counts = 0
+        self.estimated_rows = None
+        self.clock = FakeClock()
+        self.cache = CounterCache(ttl=5, threshold=1000, clock=self.clock)
+        self.cache.register('total_rows', self.count, tables=['rows'],
+                            estimate=lambda: self.estimated_rows)
+
+    def count(self):
+        self.counts += 1
+        return self.rows
+
+    def test_count_cached_within_ttl(self):
+        # Test the count query only runs once within the ttl
+        self.assertEqual(self.cache.get('total_rows'), 10)
+        self.rows = 11
+
+        self.assertEqual(self.cache.get('total_rows'), 10)
+        self.assertEqual(self.counts, 1)
+
+    def test_count_expires_after_ttl(self):
+        # Test the count is recomputed once the ttl has passed
+        self.cache.get('total_rows')
+        self.rows = 11
+        self.clock.now = 5
+
+        self.assertEqual(self.cache.get('total_rows'), 11)
+
+    def test_write_invalidates_count(self):
+        # Test a write to a counted table drops the cached count
+        self.cache.get('total_rows')
+        self.rows = 11
+        self.cache.invalidate('rows')
+
+        self.assertEqual(self.cache.get('total_rows'), 11)
+
+    def test_write_to_other_table_keeps_count(self):
+        # Test a write to an unrelated table keeps the cached count
+        self.cache.get('total_rows')
+        self.cache.invalidate('other')
+        self.cache.get('total_rows')
+
+        self.assertEqual(self.counts, 1)
+
+    def test_approximate_count_for_large_tables(self):
+        # Test approximate mode uses the estimate above the threshold
+        self.cache.approximate = True
+        self.estimated_rows = 5000
+
+        self.assertEqual(self.cache.get('total_rows'), 5000)
+        self.assertEqual(self.counts, 0)
+
+    def test_approximate_count_falls_back_to_exact(self):
+        # Test approximate mode counts exactly below the threshold
+        # or when the table has no estimate
+        self.cache.approximate = True
+        self.estimated_rows = 500
+        self.assertEqual(self.cache.get('total_rows'), 10)
+
+        self.cache.clear()
+        self.estimated_rows = None
+        self.assertEqual(self.cache.get('total_rows'), 10)
+        self.assertEqual(self.counts, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
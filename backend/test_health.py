@@ -0,0 +1,71 @@
+import unittest
+
+from health import HealthChecks
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class HealthChecksTestCase(unittest.TestCase):
+    # This class represents the health checks test case
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.calls = 0
+        self.fail = False
+
+    def probe(self):
+        self.calls += 1
+        if self.fail:
+            raise OSError('could not connect to postgres://user:secret@db')
+        return {'keys': 2}
+
+    def make_checks(self):
+        return HealthChecks({'database': self.probe}, ttl=5, clock=self.clock)
+
+    def test_probe_results(self):
+        # Test passing probes report their details and latency
+        ready, checks, age = self.make_checks().check()
+
+        self.assertTrue(ready)
+        self.assertTrue(checks['database']['ok'])
+        self.assertEqual(checks['database']['keys'], 2)
+        self.assertGreaterEqual(checks['database']['latency_ms'], 0)
+        self.assertEqual(age, 0)
+
+    def test_failed_probe(self):
+        # Test a failing probe fails the check without its error message
+        self.fail = True
+
+        ready, checks, age = self.make_checks().check()
+
+        self.assertFalse(ready)
+        self.assertFalse(checks['database']['ok'])
+        self.assertEqual(checks['database']['error'], 'OSError')
+
+    def test_results_cached(self):
+        # Test probes run again only once the ttl has passed
+        checks = self.make_checks()
+        checks.check()
+        self.clock.now = 4
+        ready, results, age = checks.check()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(age, 4)
+
+        self.fail = True
+        self.clock.now = 5
+        ready, results, age = checks.check()
+
+        self.assertEqual(self.calls, 2)
+        self.assertFalse(ready)
+        self.assertEqual(age, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
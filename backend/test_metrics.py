@@ -0,0 +1,134 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from flask import Flask
+from prometheus_client import REGISTRY, CollectorRegistry, multiprocess
+from sqlalchemy import create_engine
+
+from auth.auth import TokenCache
+from metrics import PoolMetrics, auth_timer, setup_metrics
+from query_stats import QueryStats
+
+# Records a request and a pool gauge in a separate process
+RECORD = ("import metrics; "
+          "metrics.REQUESTS.labels('GET', '/api/artists', '200').inc(); "
+          "metrics.POOL_CONNECTIONS.labels('in_use').set(2)")
+
+
+def pool_stats(checkouts=0, timeouts=0):
+    return {'in_use': 1, 'idle': 4, 'checkouts': checkouts, 'timeouts': timeouts}
+
+
+def make_app():
+    app = Flask(__name__)
+    engine = create_engine('sqlite://')
+    QueryStats().init_app(app)
+    setup_metrics(app, pool_stats)
+
+    @app.route('/items/<int:item_id>')
+    def item(item_id):
+        with engine.connect() as connection:
+            connection.execute('SELECT 1')
+        return 'ok'
+
+    return app
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTestCase(unittest.TestCase):
+    # This class represents the metrics test case
+
+    def test_request_metrics(self):
+        # Test requests are counted by route template and timed
+        route = {'method': 'GET', 'route': '/items/<int:item_id>'}
+        requests = sample('http_requests_total', status='200', **route)
+        queries = sample('http_request_db_queries_sum', **route)
+        unmatched = sample('http_requests_total', method='GET', route='unmatched',
+                           status='404')
+
+        client = make_app().test_client()
+        client.get('/items/1')
+        client.get('/items/2')
+        client.get('/missing')
+
+        self.assertEqual(sample('http_requests_total', status='200', **route), requests + 2)
+        self.assertEqual(sample('http_request_db_queries_sum', **route), queries + 2)
+        self.assertEqual(sample('http_requests_total', method='GET', route='unmatched',
+                                status='404'), unmatched + 1)
+        self.assertGreater(sample('http_request_duration_seconds_count', **route), 0)
+
+    def test_pool_metrics(self):
+        # Test the pool counters follow the checkouts of the pool
+        stats = pool_stats(checkouts=5, timeouts=1)
+        pool_metrics = PoolMetrics(lambda: stats)
+        checkouts = sample('db_pool_checkouts_total')
+        timeouts = sample('db_pool_timeouts_total')
+
+        pool_metrics.update()
+        stats['checkouts'] = 8
+        pool_metrics.update()
+
+        self.assertEqual(sample('db_pool_checkouts_total'), checkouts + 8)
+        self.assertEqual(sample('db_pool_timeouts_total'), timeouts + 1)
+        self.assertEqual(sample('db_pool_connections', state='idle'), 4)
+
+    def test_auth_timer(self):
+        # Test each step is timed, including steps which raise
+        count = sample('auth_duration_seconds_count', step='jwt_decode')
+
+        with auth_timer('jwt_decode'):
+            pass
+        with self.assertRaises(ValueError):
+            with auth_timer('jwt_decode'):
+                raise ValueError
+
+        self.assertEqual(sample('auth_duration_seconds_count', step='jwt_decode'), count + 2)
+
+    def test_token_cache_metrics(self):
+        # Test the hits and misses of the verified token cache are counted
+        cache = TokenCache(clock=lambda: 0)
+        hits = sample('auth_token_cache_hits_total')
+        misses = sample('auth_token_cache_misses_total')
+
+        cache.get('token')
+        cache.set('token', {'exp': 60})
+        cache.get('token')
+        cache.get('token')
+
+        self.assertEqual(sample('auth_token_cache_hits_total'), hits + 2)
+        self.assertEqual(sample('auth_token_cache_misses_total'), misses + 1)
+
+    def test_multiprocess_metrics(self):
+        # Test the metrics of worker processes are summed, leaving the
+        # gauges of stopped workers out
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory)
+            workers = [subprocess.Popen([sys.executable, '-c', RECORD], env=env,
+                                        cwd=os.path.dirname(os.path.abspath(__file__)))
+                       for _ in range(2)]
+            for worker in workers:
+                self.assertEqual(worker.wait(), 0)
+
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry, path=directory)
+            self.assertEqual(registry.get_sample_value('http_requests_total', {
+                'method': 'GET', 'route': '/api/artists', 'status': '200'}), 2)
+            self.assertEqual(registry.get_sample_value('db_pool_connections',
+                                                       {'state': 'in_use'}), 4)
+
+            multiprocess.mark_process_dead(workers[0].pid, directory)
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry, path=directory)
+            self.assertEqual(registry.get_sample_value('http_requests_total', {
+                'method': 'GET', 'route': '/api/artists', 'status': '200'}), 2)
+            self.assertEqual(registry.get_sample_value('db_pool_connections',
+                                                       {'state': 'in_use'}), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
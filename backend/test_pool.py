@@ -0,0 +1,71 @@
+import sqlite3
+import unittest
+from sqlalchemy import exc
+from sqlalchemy.pool import NullPool
+
+from pool import TimedQueuePool, TimedNullPool, engine_options
+
+
+def connect():
+    return sqlite3.connect(':memory:', check_same_thread=False)
+
+
+class PoolTestCase(unittest.TestCase):
+    # This class represents the connection pool test case
+
+    def test_queue_pool_counts_connections(self):
+        # Test connections in use and overflow follow checkouts
+        pool = TimedQueuePool(connect, pool_size=1, max_overflow=1, timeout=0.01)
+        first = pool.connect()
+        second = pool.connect()
+
+        stats = pool.stats()
+        self.assertEqual(stats['in_use'], 2)
+        self.assertEqual(stats['overflow'], 1)
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertIsNotNone(stats['average_checkout_ms'])
+
+        first.close()
+        second.close()
+        stats = pool.stats()
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['overflow'], 0)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_queue_pool_counts_timeouts(self):
+        # Test a checkout waiting longer than the timeout is counted
+        pool = TimedQueuePool(connect, pool_size=1, max_overflow=0, timeout=0.01)
+        connection = pool.connect()
+
+        with self.assertRaises(exc.TimeoutError):
+            pool.connect()
+
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        self.assertEqual(pool.stats()['in_use'], 1)
+        connection.close()
+
+    def test_null_pool(self):
+        # Test the PgBouncer pool keeps no connections
+        pool = TimedNullPool(connect)
+        pool.connect().close()
+
+        stats = pool.stats()
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['checkouts'], 1)
+        self.assertIsNone(stats['overflow'])
+
+    def test_engine_options(self):
+        # Test the pool settings, which PgBouncer mode leaves out
+        options = engine_options(pgbouncer=False, size=3, max_overflow=2,
+                                 timeout=5, recycle=60, pre_ping=True)
+        self.assertEqual(options['poolclass'], TimedQueuePool)
+        self.assertEqual(options['pool_size'], 3)
+        self.assertEqual(options['pool_recycle'], 60)
+
+        options = engine_options(pgbouncer=True)
+        self.assertTrue(issubclass(options['poolclass'], NullPool))
+        self.assertNotIn('pool_size', options)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import io
+import json
+import unittest
+from unittest import mock
+from datetime import datetime
+from flask import Flask
+from sqlalchemy import create_engine
+
+from query_stats import QueryStats, log_handler, redact
+
+
+def make_app(slow_query_ms=1000, server_timing=True, log_level='INFO'):
+    app = Flask(__name__)
+    engine = create_engine('sqlite://')
+    QueryStats(slow_query_ms, server_timing, log_level).init_app(app)
+
+    @app.route('/')
+    def index():
+        with engine.connect() as connection:
+            connection.execute('SELECT 1').scalar()
+            connection.execute("SELECT 'jane@example.com' = ?", ('jane@example.com',))
+        return 'ok'
+
+    return app
+
+
+class QueryStatsTestCase(unittest.TestCase):
+    # This class represents the query statistics test case
+
+    def test_server_timing(self):
+        # Test the statements of a request are counted in the header
+        res = make_app().test_client().get('/')
+
+        timing = res.headers['Server-Timing']
+        self.assertIn('db;desc="2 queries";dur=', timing)
+        self.assertIn('db-slowest;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    def test_server_timing_off(self):
+        # Test the header is left out when disabled
+        res = make_app(server_timing=False).test_client().get('/')
+
+        self.assertNotIn('Server-Timing', res.headers)
+
+    def test_request_log(self):
+        # Test one structured line is logged per request
+        with self.assertLogs('query_stats', 'INFO') as logs:
+            make_app().test_client().get('/')
+
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(line['event'], 'request')
+        self.assertEqual(line['path'], '/')
+        self.assertEqual(line['status'], 200)
+        self.assertEqual(line['queries'], 2)
+        self.assertIsNotNone(line['slowest_statement'])
+
+    def test_request_log_written(self):
+        # Test the request lines are written by the configured handler at
+        # INFO, and left out at WARNING
+        stream = io.StringIO()
+        with mock.patch.object(log_handler, 'stream', stream):
+            make_app().test_client().get('/')
+        line = json.loads(stream.getvalue().splitlines()[-1])
+        self.assertEqual(line['event'], 'request')
+
+        stream = io.StringIO()
+        with mock.patch.object(log_handler, 'stream', stream):
+            make_app(log_level='WARNING').test_client().get('/')
+        self.assertEqual(stream.getvalue(), '')
+
+    def test_slow_query_log(self):
+        # Test slow statements are logged without their string values
+        with self.assertLogs('query_stats', 'WARNING') as logs:
+            make_app(slow_query_ms=0).test_client().get('/')
+
+        slow = [json.loads(record.getMessage()) for record in logs.records
+                if record.levelname == 'WARNING']
+        self.assertEqual(len(slow), 2)
+        self.assertEqual(slow[1]['statement'], "SELECT 'jane@example.com' = ?")
+        self.assertEqual(slow[1]['parameters'], ['<redacted>'])
+        self.assertNotIn('jane@example.com', json.dumps(slow[1]['parameters']))
+
+    def test_redact(self):
+        # Test strings are redacted and other values and rows kept
+        date = datetime(2030, 1, 1)
+        self.assertEqual(redact({'name': 'Jane', 'id': 3, 'date': date, 'note': None}),
+                         {'name': '<redacted>', 'id': 3, 'date': date, 'note': None})
+        self.assertEqual(redact([{'id': id} for id in range(7)]),
+                         [{'id': id} for id in range(5)] + ['... 2 more'])
+
+
+if __name__ == '__main__':
+    unittest.main()
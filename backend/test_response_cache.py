@@ -0,0 +1,157 @@
+import unittest
+from flask import Flask, jsonify
+
+from response_cache import (MemoryBackend, SharedBackend, ResponseCache,
+                            make_backend)
+from versions import SharedTableVersions
+
+
+# Stand-in for a Redis client, holding the values in a dict
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.expiry = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        self.expiry[key] = ex
+        return True
+
+    def incr(self, key):
+        self.values[key] = int(self.values.get(key, 0)) + 1
+        return self.values[key]
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def scan_iter(self, match):
+        prefix = match.rstrip('*')
+        return [key for key in list(self.values) if key.startswith(prefix)]
+
+    def info(self, section):
+        return {'used_memory': sum(len(value) for value in self.values.values())}
+
+
+# Table versions held in a dict
+class FakeVersions(dict):
+    def get(self, table):
+        return dict.get(self, table, 0)
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    # This class represents the response cache test case
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.now = 0
+        self.versions = FakeVersions()
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        return jsonify({'success': True, 'build': self.builds})
+
+    def respond(self, cache, url='/api/artists', scope='public',
+                tables=('artists',)):
+        with self.app.test_request_context(url):
+            return cache.respond(scope, tables, self.build).get_json()
+
+    def test_memory_backend_evicts_least_recently_used(self):
+        # Test the memory backend stays within its byte budget
+        backend = MemoryBackend(ttl=60, max_bytes=25)
+        backend.set('a', b'x' * 9)
+        backend.set('b', b'x' * 9)
+        backend.get('a')
+        backend.set('c', b'x' * 9)
+
+        self.assertEqual(backend.get('a'), b'x' * 9)
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.stats()['bytes'], 20)
+
+    def test_memory_backend_expires_entries(self):
+        # Test entries are dropped after the TTL
+        backend = MemoryBackend(ttl=60, max_bytes=100, clock=lambda: self.now)
+        backend.set('a', b'x')
+        self.now = 60
+
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.stats()['entries'], 0)
+
+    def test_respond_caches_until_version_changes(self):
+        # Test a response is reused until a table it depends on is written
+        cache = ResponseCache(MemoryBackend(), self.versions)
+
+        self.assertEqual(self.respond(cache)['build'], 1)
+        self.assertEqual(self.respond(cache)['build'], 1)
+        self.versions['artists'] = 1
+        self.assertEqual(self.respond(cache)['build'], 2)
+        self.assertEqual(cache.stats()['hit_ratio'], 1 / 3)
+
+    def test_key_includes_args_and_scope(self):
+        # Test requests with other arguments or permissions are not
+        # answered with each other's responses
+        cache = ResponseCache(MemoryBackend(), self.versions)
+        self.respond(cache, '/api/clients?page=1&per_page=5', 'permissions:get:all')
+
+        self.assertEqual(self.respond(cache, '/api/clients?per_page=5&page=1',
+                                      'permissions:get:all')['build'], 1)
+        self.assertEqual(self.respond(cache, '/api/clients?page=2&per_page=5',
+                                      'permissions:get:all')['build'], 2)
+        self.assertEqual(self.respond(cache, '/api/clients?page=1&per_page=5',
+                                      'public')['build'], 3)
+
+    def test_errors_not_cached(self):
+        # Test only successful responses are cached
+        cache = ResponseCache(MemoryBackend(), self.versions)
+
+        def build():
+            self.builds += 1
+            return jsonify({'success': False}), 404
+
+        for _ in range(2):
+            with self.app.test_request_context('/api/artists/1000'):
+                cache.respond('public', ('artists',), build)
+
+        self.assertEqual(self.builds, 2)
+
+    def test_shared_backend(self):
+        # Test the shared backend against a stand-in Redis client
+        client = FakeRedis()
+        client.set('session:1', b'other data')
+        cache = ResponseCache(SharedBackend(client, ttl=30), self.versions)
+        self.respond(cache)
+
+        self.assertEqual(self.respond(cache)['build'], 1)
+        self.assertEqual([ex for key, ex in client.expiry.items()
+                          if key.startswith('response:')], [30])
+        self.assertEqual(cache.stats()['entries'], 1)
+
+        cache.clear()
+        self.assertEqual(list(client.values), ['session:1'])
+
+    def test_shared_backend_invalidated_by_other_host(self):
+        # Test a write on one host invalidates the responses cached by
+        # another when both keep their table versions in the server
+        client = FakeRedis()
+        host_a = ResponseCache(SharedBackend(client), SharedTableVersions(client))
+        host_b = ResponseCache(SharedBackend(client), SharedTableVersions(client))
+        self.respond(host_b)
+        self.assertEqual(self.respond(host_a)['build'], 1)
+
+        host_a.versions.bump('artists')
+
+        self.assertEqual(self.respond(host_b)['build'], 2)
+
+    def test_shared_backend_needs_url(self):
+        # Test the shared backend is not created without a server URL
+        with self.assertRaises(RuntimeError):
+            make_backend('shared', None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import json
+import unittest
+from datetime import date, datetime
+from flask import Flask, jsonify
+
+import serialization
+from serialization import dumps, json_response
+
+
+class SerializationTestCase(unittest.TestCase):
+    # This class represents the JSON serialization test case
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.payloads = [
+            {'success': True, 'artists': [], 'next_page': None},
+            {'b': 1, 'a': {'d': [1, 'two', None], 'c': False}},
+            {'appointment_date': datetime(2021, 8, 4, 14, 30),
+             'day': date(2021, 8, 4)},
+            {'name': 'Zoë   \x7f \x01 "quoted" \\ /', 'id': 2},
+            {'count': 2 ** 70}
+        ]
+
+    def assert_jsonify_bytes(self):
+        with self.app.test_request_context():
+            for payload in self.payloads:
+                self.assertEqual(json_response(payload).get_data(),
+                                 jsonify(payload).get_data())
+
+    def test_same_bytes_as_jsonify(self):
+        # Test responses are byte for byte the ones jsonify sends
+        self.assert_jsonify_bytes()
+
+    def test_same_bytes_without_orjson(self):
+        # Test the standard library fallback sends the same bytes
+        orjson = serialization.orjson
+        serialization.orjson = None
+        self.addCleanup(setattr, serialization, 'orjson', orjson)
+
+        self.assert_jsonify_bytes()
+
+    def test_floats_same_values(self):
+        # Test floats, which the rows do not hold, decode to the values
+        # jsonify sends even where orjson writes them differently
+        payload = {'values': [0.1, 1e20, 1e-05, -2.5, 123456789.125]}
+        with self.app.test_request_context():
+            self.assertEqual(json.loads(json_response(payload).get_data()),
+                             json.loads(jsonify(payload).get_data()))
+
+    def test_unserializable_value(self):
+        # Test values jsonify rejects are rejected as well
+        with self.assertRaises(TypeError):
+            dumps({'value': object()})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import shutil
+import tempfile
+import unittest
+from multiprocessing import Pool
+
+from versions import TableVersions, SharedTableVersions, make_table_versions
+
+
+# Stand-in for a Redis client, holding the values in a dict
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, nx=False):
+        if nx and key in self.values:
+            return None
+        self.values[key] = str(value).encode('ascii')
+        return True
+
+    def incr(self, key):
+        self.values[key] = str(int(self.values.get(key, 0)) + 1).encode('ascii')
+        return int(self.values[key])
+
+
+# Bump a table from a separate process
+def bump_in_process(directory, table, times):
+    versions = TableVersions(directory)
+    for _ in range(times):
+        versions.bump(table)
+
+
+class TableVersionsTestCase(unittest.TestCase):
+    # This class represents the table versions test case
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.versions = TableVersions(self.directory)
+
+    def test_version_stable_without_writes(self):
+        # Test reading a version does not change it
+        version = self.versions.get('artists')
+
+        self.assertEqual(self.versions.get('artists'), version)
+
+    def test_bump_changes_version(self):
+        # Test a bump changes the version of that table only
+        artists = self.versions.get('artists')
+        clients = self.versions.get('clients')
+        self.versions.bump('artists')
+
+        self.assertEqual(self.versions.get('artists'), artists + 1)
+        self.assertEqual(self.versions.get('clients'), clients)
+
+    def test_versions_shared_between_processes(self):
+        # Test bumps made by other processes are all seen
+        version = self.versions.get('artists')
+        with Pool(4) as pool:
+            pool.starmap(bump_in_process,
+                         [(self.directory, 'artists', 25)] * 4)
+
+        self.assertEqual(self.versions.get('artists'), version + 100)
+
+    def test_new_directory_starts_at_new_version(self):
+        # Test versions are not reused after the directory is cleared
+        version = self.versions.get('artists')
+        shutil.rmtree(self.directory)
+
+        self.assertNotEqual(TableVersions(self.directory).get('artists'),
+                            version)
+
+
+class SharedTableVersionsTestCase(unittest.TestCase):
+    # This class represents the table versions kept in Redis test case
+
+    def setUp(self):
+        self.client = FakeRedis()
+
+    def test_bump_seen_by_every_host(self):
+        # Test a bump made by one host changes the version on another
+        host_a = SharedTableVersions(self.client)
+        host_b = SharedTableVersions(self.client)
+        version = host_b.get('artists')
+        host_a.bump('artists')
+
+        self.assertEqual(host_b.get('artists'), version + 1)
+        self.assertTrue(host_b.shared)
+
+    def test_bump_before_get_starts_at_new_version(self):
+        # Test a first bump does not start from a reused version
+        versions = SharedTableVersions(self.client)
+
+        self.assertNotEqual(versions.bump('artists'), 1)
+        self.assertEqual(versions.get('artists'), versions.get('artists'))
+
+    def test_versions_local_without_url(self):
+        # Test versions are kept in files when no server is configured
+        self.assertFalse(make_table_versions(None).shared)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import fcntl
+import os
+import random
+import tempfile
+
+# Directory holding one version file per table, shared by the worker
+# processes on a host
+TABLE_VERSIONS_DIR = os.environ.get(
+    'TABLE_VERSIONS_DIR',
+    os.path.join(tempfile.gettempdir(), 'tattoo-api-versions')
+)
+# Redis server holding the versions instead, shared by every host. The
+# shared response cache keeps them in its own server unless set, so a
+# write on one host invalidates the cached responses of every host
+TABLE_VERSIONS_URL = os.environ.get(
+    'TABLE_VERSIONS_URL',
+    os.environ.get('RESPONSE_CACHE_URL')
+    if os.environ.get('RESPONSE_CACHE_BACKEND') == 'shared' else None
+)
+
+'''
+Table versions
+A version number per table, bumped by the model methods after every
+write. Responses built from a table use its version as their ETag, so a
+conditional request can be answered without querying the database.
+Each version lives in a small file so every worker process on a host
+sees a bump made by any other, or in Redis when TABLE_VERSIONS_URL is
+set so every host sees it. A new version starts at a random number, so
+versions are not reused after the files or keys are cleared
+'''
+
+# Versions are stored zero padded so a read never sees a partial write
+VERSION_WIDTH = 20
+
+
+# Random first version of a table
+def first_version():
+    return random.randrange(10 ** (VERSION_WIDTH - 2))
+
+
+# Versions kept in files, only seen by the processes of one host
+class TableVersions:
+    shared = False
+
+    def __init__(self, directory=TABLE_VERSIONS_DIR):
+        self.directory = directory
+
+    def _path(self, table):
+        return os.path.join(self.directory, table + '.version')
+
+    def _open(self, table):
+        os.makedirs(self.directory, exist_ok=True)
+        return os.open(self._path(table), os.O_RDWR | os.O_CREAT, 0o644)
+
+    # Read the version of the locked file, starting it when empty
+    def _read_locked(self, fd):
+        data = os.pread(fd, VERSION_WIDTH, 0)
+        if len(data) == VERSION_WIDTH:
+            return int(data)
+
+        version = first_version()
+        self._write_locked(fd, version)
+        return version
+
+    def _write_locked(self, fd, version):
+        os.pwrite(fd, str(version).zfill(VERSION_WIDTH).encode('ascii'), 0)
+
+    def get(self, table):
+        try:
+            with open(self._path(table), 'rb') as version_file:
+                data = version_file.read(VERSION_WIDTH)
+            if len(data) == VERSION_WIDTH:
+                return int(data)
+        except (OSError, ValueError):
+            pass
+
+        # The table was never written to since the directory was created
+        fd = self._open(table)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            return self._read_locked(fd)
+        finally:
+            os.close(fd)
+
+    def bump(self, table):
+        fd = self._open(table)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            version = self._read_locked(fd) + 1
+            self._write_locked(fd, version)
+            return version
+        finally:
+            os.close(fd)
+
+
+# Versions kept in Redis, seen by every host. Any client with the
+# get/set/incr methods of redis.Redis can be used
+class SharedTableVersions:
+    shared = True
+
+    def __init__(self, client, prefix='version:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, table):
+        key = self.prefix + table
+        version = self.client.get(key)
+        if version is None:
+            # Concurrent starts agree on the first version set
+            self.client.set(key, first_version(), nx=True)
+            version = self.client.get(key)
+        return int(version)
+
+    def bump(self, table):
+        key = self.prefix + table
+        self.client.set(key, first_version(), nx=True)
+        return self.client.incr(key)
+
+
+# Create the versions kept in the Redis server at url, or in files on
+# this host without one. The redis package is only needed for the former
+def make_table_versions(url=TABLE_VERSIONS_URL):
+    if url is None:
+        return TableVersions()
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError('Table versions in Redis need the redis package')
+    return SharedTableVersions(redis.Redis.from_url(url))
+
+
+table_versions = make_table_versions()
@@ -0,0 +1,64 @@
+"""normalize artist styles
+
+Revision ID: 4c2a7e91f5b3
+Revises: d81f4a6c0e29
+Create Date: 2026-10-18 13:02:45.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c2a7e91f5b3'
+down_revision = 'd81f4a6c0e29'
+branch_labels = None
+depends_on = None
+
+# Split artists.styles the way models.split_styles does
+SPLIT_STYLES = (
+    "SELECT artists.id AS artist_id, "
+    "lower(regexp_replace(trim(style), '\\s+', ' ', 'g')) AS name "
+    "FROM artists, regexp_split_to_table(artists.styles, '[,;/]') AS style "
+    "WHERE trim(style) <> ''"
+)
+
+
+def upgrade():
+    op.create_table('styles',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('artist_styles',
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('style_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['artists.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['style_id'], ['styles.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('artist_id', 'style_id')
+    )
+    op.create_index('ix_artist_styles_style_id_artist_id', 'artist_styles',
+                    ['style_id', 'artist_id'], unique=False)
+
+    op.execute(
+        'INSERT INTO styles (name) '
+        'SELECT DISTINCT name FROM (' + SPLIT_STYLES + ') AS split '
+        'ORDER BY name'
+    )
+    op.execute(
+        'INSERT INTO artist_styles (artist_id, style_id) '
+        'SELECT DISTINCT split.artist_id, styles.id '
+        'FROM (' + SPLIT_STYLES + ') AS split '
+        'JOIN styles ON styles.name = split.name'
+    )
+
+    # The style filter joins through artist_styles. Databases migrated
+    # while d81f4a6c0e29 still created a text index of the styles drop it
+    op.execute('DROP INDEX IF EXISTS ix_artists_styles')
+
+
+def downgrade():
+    op.drop_index('ix_artist_styles_style_id_artist_id', table_name='artist_styles')
+    op.drop_table('artist_styles')
+    op.drop_table('styles')
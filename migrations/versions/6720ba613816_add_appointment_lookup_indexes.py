@@ -0,0 +1,31 @@
+"""add appointment lookup indexes
+
+Revision ID: 6720ba613816
+Revises: 2f00b28ce7d6
+Create Date: 2026-10-18 09:12:41.527310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6720ba613816'
+down_revision = '2f00b28ce7d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_appointment_artist_appointment_date', 'appointment',
+                    ['artist', 'appointment_date'], unique=False)
+    op.create_index('ix_appointment_client_appointment_date', 'appointment',
+                    ['client', 'appointment_date'], unique=False)
+    op.create_index('ix_appointment_appointment_date', 'appointment',
+                    ['appointment_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_appointment_appointment_date', table_name='appointment')
+    op.drop_index('ix_appointment_client_appointment_date', table_name='appointment')
+    op.drop_index('ix_appointment_artist_appointment_date', table_name='appointment')
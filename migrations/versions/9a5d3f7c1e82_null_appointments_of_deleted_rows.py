@@ -0,0 +1,40 @@
+"""null the appointments of deleted artists and clients
+
+Revision ID: 9a5d3f7c1e82
+Revises: 4c2a7e91f5b3
+Create Date: 2026-10-18 18:12:09.531846
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a5d3f7c1e82'
+down_revision = '4c2a7e91f5b3'
+branch_labels = None
+depends_on = None
+
+# Foreign keys of the appointments, with the names Postgres gave them in
+# f396d5114836. Databases restored from tattoo_shop.psql name them after
+# the column instead
+FOREIGN_KEYS = (
+    ('appointment_artist_fkey', 'artist', 'artists'),
+    ('appointment_client_fkey', 'client', 'clients'),
+)
+
+
+def upgrade():
+    # Deleting an artist or client leaves its appointments to the
+    # database, see the passive_deletes relationships of the models
+    for name, column, table in FOREIGN_KEYS:
+        op.execute('ALTER TABLE appointment DROP CONSTRAINT IF EXISTS ' + name)
+        op.execute('ALTER TABLE appointment DROP CONSTRAINT IF EXISTS ' + column)
+        op.create_foreign_key(name, 'appointment', table, [column], ['id'],
+                              onupdate='CASCADE', ondelete='SET NULL')
+
+
+def downgrade():
+    for name, column, table in FOREIGN_KEYS:
+        op.drop_constraint(name, 'appointment', type_='foreignkey')
+        op.create_foreign_key(name, 'appointment', table, [column], ['id'])
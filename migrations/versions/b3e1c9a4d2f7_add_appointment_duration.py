@@ -0,0 +1,34 @@
+"""add appointment duration and double booking constraint
+
+Revision ID: b3e1c9a4d2f7
+Revises: 6720ba613816
+Create Date: 2026-10-18 10:04:17.208415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e1c9a4d2f7'
+down_revision = '6720ba613816'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('appointment', sa.Column('duration', sa.Integer(),
+                                           server_default='60', nullable=False))
+    # Fails if the table already holds overlapping bookings of an artist,
+    # which have to be moved before upgrading
+    op.execute(
+        "ALTER TABLE appointment ADD CONSTRAINT appointment_artist_no_overlap "
+        "EXCLUDE USING gist (int4range(artist, artist, '[]') WITH =, "
+        "tsrange(appointment_date, appointment_date + duration * interval '1 minute') WITH &&) "
+        "WHERE (artist IS NOT NULL)"
+    )
+
+
+def downgrade():
+    op.drop_constraint('appointment_artist_no_overlap', 'appointment')
+    op.drop_column('appointment', 'duration')
@@ -0,0 +1,35 @@
+"""add artist and client search indexes
+
+Revision ID: d81f4a6c0e29
+Revises: b3e1c9a4d2f7
+Create Date: 2026-10-18 11:26:03.614872
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81f4a6c0e29'
+down_revision = 'b3e1c9a4d2f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute(
+        "CREATE INDEX ix_artists_search ON artists USING gist "
+        "(lower(name || ' ' || coalesce(email, '') || ' ' || coalesce(phone, '') "
+        "|| ' ' || coalesce(styles, '')) gist_trgm_ops(siglen=256))"
+    )
+    op.execute(
+        "CREATE INDEX ix_clients_search ON clients USING gist "
+        "(lower(name || ' ' || coalesce(email, '') || ' ' || coalesce(phone, '')) "
+        "gist_trgm_ops(siglen=256))"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_clients_search', table_name='clients')
+    op.drop_index('ix_artists_search', table_name='artists')